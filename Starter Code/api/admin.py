@@ -1,20 +1,150 @@
 from django.contrib import admin
-from api.models import Order, OrderItem, User, Product
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+from api import rollups
+from api.changes import record_changes
+from api.events import publish_order_status
+from api.models import ChangeEvent, Order, OrderItem, User, Product
+
+
+def estimate_row_count(model):
+    """
+    Asks the database for its *estimate* of the number of rows in the
+    model's table. That's a tiny catalog lookup instead of a full
+    'COUNT(*)', which has to scan the whole table on big tables.
+
+    Returns None if the database doesn't have an estimate.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table])
+        elif connection.vendor == 'sqlite':
+            # Only filled in after running 'ANALYZE'.
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute(
+                'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1',
+                [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+        else:
+            return None
+        row = cursor.fetchone()
+    # Postgres says -1 for tables that were never analyzed.
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the database's row estimate for the *unfiltered* changelist of
+    a big table. With a filter or search applied we still count exactly,
+    because then the estimate of the whole table would be wrong.
+    """
+    # Below this many rows an exact COUNT(*) is cheap anyway.
+    exact_count_below = 10000
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list,
+                      QuerySet) and not self.object_list.query.where:
+            estimate = estimate_row_count(self.object_list.model)
+            if estimate is not None and estimate >= self.exact_count_below:
+                return estimate
+        return super().count
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Don't run a second COUNT(*) of the whole table just to show
+    # "5 results (1,000,000 total)" when filtering.
+    show_full_result_count = False
 
 
 # Register your models here.
 class OrderItemInLine(admin.TabularInline):
     model = OrderItem
+    extra = 0
+    # A normal <select> would render *every* product into every inline
+    # row. Autocomplete loads matching products on demand instead
+    # (it needs 'search_fields' on ProductAdmin).
+    autocomplete_fields = ['product']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
 
 
-class OrderAdmin(admin.ModelAdmin):
+def update_order_status(queryset, new_status):
+    """
+    Sets the status of every order in 'queryset' with one UPDATE
+    (instead of saving every order on its own) and returns how many
+    orders changed.
+
+    '.update()' skips 'save()' and its signals, so we read the old
+    statuses first (locked, in the same transaction) and record/announce
+    the changes (and update the rollups) ourselves.
+    """
+    queryset = queryset.exclude(status=new_status)
+    with transaction.atomic():
+        changed = list(
+            queryset.select_for_update().values_list('order_id', 'user_id',
+                                                     'status'))
+        queryset.update(status=new_status)
+        record_changes(Order, [order_id for order_id, _, _ in changed],
+                       ChangeEvent.Actions.UPDATE)
+        for order_id, user_id, old_status in changed:
+            publish_order_status(order_id, user_id, old_status, new_status)
+        rollups.move_orders(changed, new_status)
+    return len(changed)
+
+
+@admin.action(description='Mark selected orders as Confirmed')
+def mark_confirmed(modeladmin, request, queryset):
+    updated = update_order_status(queryset, Order.StatusChoices.CONFIRMED)
+    modeladmin.message_user(request, f'{updated} order(s) confirmed.')
+
+
+@admin.action(description='Mark selected orders as Cancelled')
+def mark_cancelled(modeladmin, request, queryset):
+    updated = update_order_status(queryset, Order.StatusChoices.CANCELLED)
+    modeladmin.message_user(request, f'{updated} order(s) cancelled.')
+
+
+class OrderAdmin(ScalableModelAdmin):
     inlines = [OrderItemInLine]
+    list_display = ('order_id', 'user', 'status', 'created_at')
+    # 'Order.__str__' and the 'user' column need the user; fetch it in
+    # the same query instead of one query per row.
+    list_select_related = ('user', )
+    # Both are indexed (see 'Order.Meta.indexes').
+    list_filter = ('status', 'created_at')
+    # Exact matches only, so the database can use an index.
+    search_fields = ('=order_id', '=user__username')
+    raw_id_fields = ('user', )
+    actions = [mark_confirmed, mark_cancelled]
+
+
+class ProductAdmin(ScalableModelAdmin):
+    list_display = ('name', 'price', 'stock')
+    search_fields = ('name', )
 
 
 # No need to do the line & admin class for the default model just the one
 # wiht complex query like the order and order item classes
 
 admin.site.register(Order, OrderAdmin)
-admin.site.register(Product)
+admin.site.register(Product, ProductAdmin)
 admin.site.register(User)
 # admin.site.register()
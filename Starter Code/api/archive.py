@@ -0,0 +1,110 @@
+"""
+Hot/cold storage for orders.
+
+Old orders that are finished (confirmed or cancelled) are moved from
+'Order'/'OrderItem' into 'ArchivedOrder'/'ArchivedOrderItem' by
+'archive_orders()' (run by 'manage.py archive_orders'). The order
+endpoints only look at the archive when a date filter asks for orders
+old enough to be there ('reaches_archive()').
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api import changes, rollups
+from api.models import (ArchivedOrder, ArchivedOrderItem, ChangeEvent, Order,
+                        OrderItem)
+
+ARCHIVABLE_STATUSES = (Order.StatusChoices.CONFIRMED,
+                       Order.StatusChoices.CANCELLED)
+
+
+def archive_batch(cutoff, batch_size):
+    """
+    Moves up to 'batch_size' archivable orders created before 'cutoff'
+    (and their items) in ONE transaction. Returns how many were moved.
+    """
+    with transaction.atomic():
+        candidates = Order.objects.filter(
+            status__in=ARCHIVABLE_STATUSES,
+            created_at__lt=cutoff).order_by('created_at')
+        if connection.features.has_select_for_update_skip_locked:
+            # Two archivers running at once take different rows instead
+            # of waiting on each other.
+            candidates = candidates.select_for_update(skip_locked=True)
+        orders = list(
+            candidates.values('order_id', 'user_id', 'created_at',
+                              'status')[:batch_size])
+        if not orders:
+            return 0
+
+        ids = [order['order_id'] for order in orders]
+        items = list(
+            OrderItem.objects.filter(order_id__in=ids).values(
+                'pk', 'order_id', 'product_id', 'quantity', 'unit_price',
+                'product__name'))
+        ArchivedOrder.objects.bulk_create(
+            [ArchivedOrder(**order) for order in orders])
+        # The name is copied: the archive must not depend on the product
+        # still existing.
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(order_id=item['order_id'],
+                              product_id=item['product_id'],
+                              product_name=item['product__name'],
+                              unit_price=item['unit_price'],
+                              quantity=item['quantity']) for item in items
+        ])
+
+        # Deleting would normally add a "delete" event per order and item
+        # to the change feed; an "archive" event for each of them is what
+        # actually happened (consumers drop them from the live data).
+        with changes.paused():
+            Order.objects.filter(pk__in=ids).delete()  # items cascade
+        changes.record_changes(Order, ids, ChangeEvent.Actions.ARCHIVE)
+        changes.record_changes(OrderItem, [item['pk'] for item in items],
+                               ChangeEvent.Actions.ARCHIVE)
+        # Archived orders still count in the users' summaries; recount
+        # the last order time anyway, so it always matches the tables.
+        rollups.recount_last_order_at({order['user_id'] for order in orders})
+    return len(orders)
+
+
+def archive_orders(older_than_days, batch_size=500):
+    """
+    Archives every archivable order older than 'older_than_days', one
+    batch (= one short transaction) at a time. Returns the total moved.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            return total
+        total += moved
+
+
+def reaches_archive(cleaned_data):
+    """
+    Given the cleaned 'OrderFilter' values, tells if the requested date
+    range can include archived orders, i.e. its lower end ('created_at'
+    or 'created_at__gt', or none at all with 'created_at__lt') is not
+    newer than the newest archived order.
+
+    No date filter means "current orders", so the archive is skipped.
+    """
+    exact = cleaned_data.get('created_at')
+    before = cleaned_data.get('created_at__lt')
+    after = cleaned_data.get('created_at__gt')
+    if exact is None and before is None and after is None:
+        return False
+
+    # MAX() on an indexed column is a single index lookup.
+    horizon = ArchivedOrder.objects.aggregate(
+        newest=Max('created_at'))['newest']
+    if horizon is None:
+        return False
+
+    lower = exact if exact is not None else after
+    return lower is None or lower <= horizon
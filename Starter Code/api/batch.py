@@ -0,0 +1,191 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, transaction
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from api import rollups
+from api.changes import record_changes
+from api.models import ChangeEvent, Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRetrieveMixin:
+    """
+    Adds "multi-get" to a list view: '/product/?ids=3,1,7'.
+
+    Instead of one request per object, the client sends the IDs it wants
+    and we load them all with a *single* query ('in_bulk'). We reuse the
+    view's own 'get_queryset()', so a user can never get more through a
+    batch than through the normal detail/list endpoints.
+
+    The response keeps the order of the request and marks what was not
+    found (or not visible to this user):
+
+        {"results": [{...id 3...}, null, {...id 7...}], "missing": [1]}
+    """
+    batch_query_param = 'ids'
+
+    def get_batch_max_size(self):
+        return getattr(settings, 'API_BATCH_MAX_IDS', 100)
+
+    def get_batch_ids(self, request):
+        raw = request.query_params.get(self.batch_query_param, '')
+        # 'dict.fromkeys' drops duplicates but keeps the original order.
+        raw_ids = list(
+            dict.fromkeys(part.strip() for part in raw.split(',')
+                          if part.strip()))
+
+        if not raw_ids:
+            raise serializers.ValidationError(
+                {self.batch_query_param: 'Provide at least one id.'})
+
+        max_size = self.get_batch_max_size()
+        if len(raw_ids) > max_size:
+            raise serializers.ValidationError({
+                self.batch_query_param:
+                f'At most {max_size} ids per request.'
+            })
+
+        # Let the model's primary key field do the parsing, so this works
+        # for integer ids (Product) and UUIDs (Order) alike.
+        # Its validators also check that integers fit the database column.
+        pk_field = self.get_queryset().model._meta.pk
+        try:
+            ids = [pk_field.to_python(value) for value in raw_ids]
+            for pk in ids:
+                pk_field.run_validators(pk)
+            return ids
+        except DjangoValidationError:
+            raise serializers.ValidationError(
+                {self.batch_query_param: 'Invalid id in list.'})
+
+    def batch_list(self, request):
+        ids = self.get_batch_ids(request)
+        found = self.get_queryset().in_bulk(ids)
+
+        results, missing = [], []
+        for pk in ids:
+            obj = found.get(pk)
+            if obj is None:
+                results.append(None)
+                missing.append(pk)
+            else:
+                results.append(self.get_serializer(obj).data)
+
+        return Response({
+            'results': results,
+            'missing': missing,
+        })
+
+    def list(self, request, *args, **kwargs):
+        if self.batch_query_param in request.query_params:
+            return self.batch_list(request)
+        return super().list(request, *args, **kwargs)
+
+
+def create_orders_in_bulk(user, orders, chunk_size):
+    """
+    Inserts already-validated orders (dicts from 'OrderBulkCreateSerializer')
+    for 'user' and returns one result per order, in the same order.
+
+    - All product ids are checked with ONE query up front. Orders that
+      point to an unknown product fail on their own; the rest go ahead.
+    - Orders and items are written with 'bulk_create', 'chunk_size'
+      orders per transaction. If the database rejects a chunk, only the
+      orders of that chunk are reported as failed.
+    """
+    product_ids = {
+        item['product']
+        for order in orders for item in order['items']
+    }
+    # 'in_bulk' splits huge id lists into several queries by itself if the
+    # database has a limit on query parameters (SQLite does).
+    existing = Product.objects.only('pk', 'price').in_bulk(product_ids)
+
+    results = [None] * len(orders)
+    to_create = []  # (index, validated data)
+    for index, data in enumerate(orders):
+        unknown = sorted({
+            item['product']
+            for item in data['items'] if item['product'] not in existing
+        })
+        if unknown:
+            results[index] = {
+                'status': 'failed',
+                'errors': {
+                    'items': [f'Invalid product id {pk}.' for pk in unknown]
+                },
+            }
+        else:
+            to_create.append((index, data))
+
+    for start in range(0, len(to_create), chunk_size):
+        chunk = to_create[start:start + chunk_size]
+
+        # The UUID primary key is generated in Python, so we already know
+        # every order_id before inserting and can link the items to it
+        # (even on databases that can't return ids from a bulk insert).
+        new_orders = [
+            Order(user=user, status=data['status']) for _, data in chunk
+        ]
+        new_items = [
+            OrderItem(order=order,
+                      product_id=item['product'],
+                      quantity=item['quantity'],
+                      unit_price=existing[item['product']].price)
+            for order, (_, data) in zip(new_orders, chunk)
+            for item in data['items']
+        ]
+
+        try:
+            with transaction.atomic():
+                Order.objects.bulk_create(new_orders)
+                OrderItem.objects.bulk_create(new_items)
+                # 'bulk_create' doesn't send signals, so we feed the
+                # change feed ourselves (same transaction).
+                record_changes(Order, [o.pk for o in new_orders],
+                               ChangeEvent.Actions.CREATE)
+                item_ids = [item.pk for item in new_items]
+                if None in item_ids:
+                    # This database doesn't return ids from a bulk
+                    # insert: read them back.
+                    item_ids = list(
+                        OrderItem.objects.filter(
+                            order__in=new_orders).values_list('pk',
+                                                              flat=True))
+                record_changes(OrderItem, item_ids, ChangeEvent.Actions.CREATE)
+                with rollups.batched():
+                    rollups.record_orders((user.pk, order.created_at,
+                                           order.status)
+                                          for order in new_orders)
+                    rollups.record_items(
+                        (user.pk, item.order.created_at, item.order.status,
+                         item.product_id, item.quantity, item.unit_price)
+                        for item in new_items)
+        except DatabaseError:
+            # The database's message can show SQL and table names: it goes
+            # to the log, the client only learns that the chunk failed.
+            logger.exception('Bulk order chunk of %s orders failed',
+                             len(chunk))
+            for index, _ in chunk:
+                results[index] = {
+                    'status': 'failed',
+                    'errors': {
+                        'non_field_errors': [
+                            'The order could not be saved, please retry.'
+                        ]
+                    },
+                }
+            continue
+
+        for order, (index, _) in zip(new_orders, chunk):
+            results[index] = {
+                'status': 'created',
+                'order_id': order.order_id,
+            }
+
+    return results
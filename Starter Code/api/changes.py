@@ -0,0 +1,121 @@
+"""
+Helpers for the change feed ('ChangeEvent' / '/changes/').
+
+Normal saves and deletes are recorded by the signal receivers in
+'signals.py'. Code that writes with 'bulk_create()' or '.update()'
+(which skip signals) calls 'record_changes()' itself.
+"""
+import contextlib
+import threading
+
+from django.db import transaction
+from django.db.models import F, Max, Min
+
+from api.models import ChangeEvent, ChangeFeedState, Order, OrderItem, Product
+from api.serializers import (OrderItemChangeSerializer, OrderSerializer,
+                             ProductSerializer)
+
+# Which models are tracked, and the name they have in the feed.
+TRACKED_MODELS = {
+    Product: 'product',
+    Order: 'order',
+    OrderItem: 'orderitem',
+}
+
+
+_state = threading.local()
+
+
+@contextlib.contextmanager
+def paused():
+    """
+    Inside this block the signal receivers don't record anything (in
+    the change feed or the sales rollups). Used when moving rows around
+    (archiving), where the caller records one meaningful event itself
+    instead of a pile of deletes.
+    """
+    previous = getattr(_state, 'paused', False)
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+
+def is_paused():
+    return getattr(_state, 'paused', False)
+
+
+def record_changes(model, object_ids, action):
+    """
+    Adds one event per id with a single INSERT. Call it inside the same
+    transaction as the change, so a rollback removes the events too.
+    """
+    ChangeEvent.objects.bulk_create([
+        ChangeEvent(model=TRACKED_MODELS[model],
+                    object_id=str(object_id),
+                    action=action) for object_id in object_ids
+    ])
+
+
+def number_events():
+    """
+    Gives a 'position' (the feed's token) to the committed events that
+    don't have one yet, above every position handed out so far.
+
+    'seq' alone isn't safe as a token: a transaction that started
+    earlier can commit a smaller 'seq' after a consumer already moved
+    past it. Only committed rows are visible here, so whatever commits
+    late is numbered late, and consumers can't skip it.
+
+    Runs on every feed read, so when there's nothing to number it's a
+    single read, no transaction.
+    """
+    pending = ChangeEvent.objects.filter(position__isnull=True)
+    if not pending.exists():
+        return
+    with transaction.atomic(durable=True):
+        # One at a time: two runs could otherwise commit out of order.
+        # Writing first takes the lock right away: on SQLite a transaction
+        # that reads first and then writes fails with "database is locked"
+        # if another one wrote in between, where this one simply waits.
+        if not ChangeFeedState.objects.filter(pk=1).update(
+                last_position=F('last_position')):
+            ChangeFeedState.objects.create(pk=1)
+        state = ChangeFeedState.objects.get(pk=1)
+        seqs = pending.aggregate(first=Min('seq'), last=Max('seq'))
+        if seqs['first'] is None:
+            return
+        # One UPDATE: 'seq + offset' keeps the 'seq' order and starts
+        # right after the last position. Rows below 'first' that commit
+        # meanwhile are left for the next run.
+        offset = state.last_position - seqs['first'] + 1
+        pending.filter(seq__range=(seqs['first'], seqs['last'])).update(
+            position=F('seq') + offset)
+        state.last_position = seqs['last'] + offset
+        state.save(update_fields=['last_position'])
+
+
+def current_data(events):
+    """
+    Returns {(model name, object id): serialized data} with the *current*
+    state of every object mentioned in 'events'. One query per model,
+    however many events there are. Deleted objects are simply missing.
+    """
+    loaders = {
+        'product': (Product.objects.all(), ProductSerializer),
+        'order':
+        (Order.objects.prefetch_related('items__product'), OrderSerializer),
+        'orderitem': (OrderItem.objects.all(), OrderItemChangeSerializer),
+    }
+
+    ids_by_model = {}
+    for event in events:
+        ids_by_model.setdefault(event.model, set()).add(event.object_id)
+
+    data = {}
+    for model_name, ids in ids_by_model.items():
+        queryset, serializer_class = loaders[model_name]
+        for pk, obj in queryset.in_bulk(list(ids)).items():
+            data[(model_name, str(pk))] = serializer_class(obj).data
+    return data
@@ -0,0 +1,221 @@
+"""
+A tiny publish/subscribe system for order status changes.
+
+Publishers (signals, admin actions) call 'publish_order_status(...)'.
+Subscribers (the Server-Sent Events stream in 'views.py') call
+'get_broker().subscribe(last_event_id)' and then 'await sub.get(...)'.
+
+Which broker is used comes from the 'ORDER_EVENTS_BROKER' setting:
+
+    ORDER_EVENTS_BROKER = {
+        'BACKEND': 'api.events.InProcessBroker',   # default
+        'OPTIONS': {'history': 1000},
+    }
+
+'InProcessBroker' only reaches subscribers in the *same* process, which
+is fine for one ASGI worker. With several workers, switch to
+'api.events.RedisBroker' (needs the 'redis' package) so every worker
+sees every event.
+"""
+import asyncio
+import collections
+import functools
+import json
+import re
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+class SubscriptionLost(Exception):
+    """
+    The subscriber fell too far behind and events were dropped. The
+    client should reconnect with 'Last-Event-ID' to replay what it missed.
+    """
+
+
+class InProcessSubscription:
+
+    def __init__(self, broker, queue, backlog):
+        self.broker = broker
+        self.queue = queue
+        self.backlog = collections.deque(backlog)
+
+    async def get(self, timeout):
+        """
+        Returns the next (event_id, data), or None if nothing arrived
+        within 'timeout' seconds.
+        """
+        if self.backlog:
+            return self.backlog.popleft()
+        try:
+            async with asyncio.timeout(timeout):
+                event = await self.queue.get()
+        except asyncio.TimeoutError:
+            return None
+        if event is InProcessBroker.OVERFLOW:
+            raise SubscriptionLost()
+        return event
+
+    async def close(self):
+        self.broker._unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Keeps the last 'history' events in memory (so clients can resume
+    with 'Last-Event-ID') and pushes new events into one asyncio queue
+    per subscriber.
+
+    'publish' may be called from any thread (Django's sync views run in
+    a thread pool under ASGI); the events are handed to each
+    subscriber's event loop with 'call_soon_threadsafe'.
+    """
+    OVERFLOW = object()
+
+    def __init__(self, history=1000, queue_size=1000):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._history = collections.deque(maxlen=history)
+        self._subscribers = {}  # subscription -> event loop
+        self.queue_size = queue_size
+
+    def publish(self, data):
+        with self._lock:
+            self._last_id += 1
+            event = (str(self._last_id), data)
+            self._history.append(event)
+            by_loop = collections.defaultdict(list)
+            for subscription, loop in self._subscribers.items():
+                by_loop[loop].append(subscription.queue)
+
+        # One wake-up per event loop (i.e. per worker), not per subscriber.
+        for loop, queues in by_loop.items():
+            loop.call_soon_threadsafe(self._deliver, queues, event)
+        return event[0]
+
+    def _deliver(self, queues, event):
+        for queue in queues:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow client: drop what's queued and tell it to reconnect.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.OVERFLOW)
+
+    def subscribe(self, last_event_id=None):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        try:
+            after = int(last_event_id)
+        except (TypeError, ValueError):
+            after = None
+
+        # Taking the backlog and registering happen under the same lock
+        # as 'publish', so no event can slip in between (or show up twice).
+        with self._lock:
+            backlog = [] if after is None else [
+                event for event in self._history if int(event[0]) > after
+            ]
+            subscription = InProcessSubscription(self, queue, backlog)
+            self._subscribers[subscription] = asyncio.get_running_loop()
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.pop(subscription, None)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+class RedisSubscription:
+    # Redis stream ids look like '1700000000000-0'.
+    STREAM_ID = re.compile(r'\d+-\d+')
+
+    def __init__(self, client, stream, last_event_id):
+        self.client = client
+        self.stream = stream
+        # 'Last-Event-ID' comes from the client: anything that isn't a
+        # stream id would make XREAD fail, so it's ignored like a missing
+        # one. '$' means "only events published from now on".
+        if last_event_id and self.STREAM_ID.fullmatch(last_event_id):
+            self.last_id = last_event_id
+        else:
+            self.last_id = '$'
+        self.buffer = collections.deque()
+
+    async def get(self, timeout):
+        if not self.buffer:
+            result = await self.client.xread({self.stream: self.last_id},
+                                             count=100,
+                                             block=int(timeout * 1000))
+            for _, entries in result or []:
+                for event_id, fields in entries:
+                    event_id = event_id.decode()
+                    self.last_id = event_id
+                    self.buffer.append(
+                        (event_id, json.loads(fields[b'data'])))
+        return self.buffer.popleft() if self.buffer else None
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class RedisBroker:
+    """
+    Uses a Redis (or any Redis-compatible server) *stream*. Every worker
+    reads the same stream, and the stream itself keeps the history
+    (trimmed to about 'maxlen' entries) for 'Last-Event-ID' resumes.
+    """
+
+    def __init__(self,
+                 url='redis://localhost:6379/0',
+                 stream='order-status',
+                 maxlen=10000):
+        import redis  # optional dependency, only needed for this broker
+
+        self.url = url
+        self.stream = stream
+        self.maxlen = maxlen
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, data):
+        event_id = self.client.xadd(self.stream, {'data': json.dumps(data)},
+                                    maxlen=self.maxlen,
+                                    approximate=True)
+        return event_id.decode()
+
+    def subscribe(self, last_event_id=None):
+        import redis.asyncio
+
+        return RedisSubscription(redis.asyncio.Redis.from_url(self.url),
+                                 self.stream, last_event_id)
+
+
+@functools.cache
+def get_broker():
+    config = getattr(settings, 'ORDER_EVENTS_BROKER', {})
+    backend = import_string(
+        config.get('BACKEND', 'api.events.InProcessBroker'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+def publish_order_status(order_id, user_id, old_status, new_status):
+    """
+    Announces that an order's status changed. Sent only after the
+    transaction commits, so nobody hears about a change that was
+    rolled back.
+    """
+    data = {
+        'order_id': str(order_id),
+        'user_id': user_id,
+        'previous_status': old_status,
+        'status': new_status,
+        'changed_at': timezone.now().isoformat(),
+    }
+    transaction.on_commit(lambda: get_broker().publish(data))
@@ -0,0 +1,114 @@
+"""
+Facet counts for the product list: '/product/?facets=1'.
+
+A storefront shows "Under 10 (4) / 10-50 (12) / ... / In stock (9)" next
+to the results. Instead of one request per count, the list response
+gets a "facets" entry computed with ONE query over the same filtered
+products:
+
+    SELECT COUNT(*),
+           COUNT(CASE WHEN stock > 0 THEN 1 END),
+           COUNT(CASE WHEN price < 10 THEN 1 END), ...
+    FROM api_product WHERE <the request's filters>
+
+The result is cached per filter (not per page), so paging through the
+results doesn't count again. Any product change invalidates the cache.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+GENERATION_KEY = 'product-facets-generation'
+
+
+def price_buckets(bounds):
+    """
+    [10, 50] -> [(None, 10), (10, 50), (50, None)]: "under 10", "10 to
+    under 50" and "50 and more".
+    """
+    edges = [None, *bounds, None]
+    return list(zip(edges, edges[1:]))
+
+
+def product_facets(queryset, bounds):
+    """
+    Total, in/out of stock and price bucket counts of 'queryset', in a
+    single query.
+    """
+    buckets = price_buckets(bounds)
+    aggregates = {
+        'total': Count('pk'),
+        'in_stock': Count('pk', filter=Q(stock__gt=0)),
+    }
+    for index, (low, high) in enumerate(buckets):
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'price_{index}'] = Count('pk', filter=condition)
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    return {
+        'total': counts['total'],
+        'stock': {
+            'in_stock': counts['in_stock'],
+            'out_of_stock': counts['total'] - counts['in_stock'],
+        },
+        'price': [{
+            'min': low,
+            'max': high,
+            'count': counts[f'price_{index}'],
+        } for index, (low, high) in enumerate(buckets)],
+    }
+
+
+def invalidate_product_facets():
+    """
+    Makes every cached facet result stale. Called (after commit) when a
+    product changes. With a per-process cache (the default LocMemCache)
+    other processes keep theirs until it expires; use a shared cache
+    (Redis, Memcached) to invalidate everywhere.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:  # not in the cache (yet, or any more)
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+class FacetsMixin:
+    """
+    Adds '?facets=1' to a list view of products: the response gets a
+    "facets" entry computed over the filtered queryset (before paging).
+    """
+    facets_query_param = 'facets'
+
+    def get_facets(self, queryset):
+        bounds = settings.PRODUCT_PRICE_FACETS
+        # The SQL with its parameters identifies the filters exactly,
+        # however the query string was written.
+        sql = str(queryset.order_by().query)
+        generation = cache.get_or_set(GENERATION_KEY, 1, timeout=None)
+        key = 'product-facets:{}:{}'.format(
+            generation,
+            hashlib.sha256(f'{sql}|{bounds}'.encode()).hexdigest())
+        facets = cache.get(key)
+        if facets is None:
+            facets = product_facets(queryset, bounds)
+            cache.set(key, facets, settings.PRODUCT_FACETS_CACHE_TIMEOUT)
+        return facets
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        wanted = request.query_params.get(self.facets_query_param)
+        if wanted not in ('1', 'true'):
+            return response
+
+        facets = self.get_facets(self.filter_queryset(self.get_queryset()))
+        if isinstance(response.data, dict):
+            response.data['facets'] = facets
+        else:  # not paginated
+            response.data = {'results': response.data, 'facets': facets}
+        return response
@@ -1,5 +1,5 @@
 import django_filters
-from api.models import Product, Order
+from api.models import ArchivedOrder, Product, Order
 from rest_framework import filters
 
 
@@ -28,3 +28,9 @@ class OrderFilter(django_filters.FilterSet):
     class Meta:
         model = Order
         fields = {'status': ['exact'], 'created_at': ['exact', 'lt', 'gt']}
+
+
+class ArchivedOrderFilter(OrderFilter):
+
+    class Meta(OrderFilter.Meta):
+        model = ArchivedOrder
@@ -0,0 +1,150 @@
+import functools
+import hashlib
+import json
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from api.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+class IdempotencyKeyInFlight(APIException):
+    """The first request with this key hasn't finished yet."""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = ('A request with this Idempotency-Key is still being '
+                      'processed. Retry shortly.')
+    default_code = 'idempotency_key_in_flight'
+    # DRF's exception handler turns 'wait' into a 'Retry-After' header.
+    wait = 1
+
+
+class IdempotencyKeyMismatch(APIException):
+    """The key was already used for a *different* request."""
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = ('This Idempotency-Key was already used with a '
+                      'different request.')
+    default_code = 'idempotency_key_mismatch'
+
+
+def request_fingerprint(request):
+    """
+    sha256 of method + path + body. We hash the *parsed* body (with
+    sorted keys) so that whitespace or key order don't matter.
+    """
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    raw = f'{request.method}\n{request.get_full_path()}\n{body}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """
+    Tries to insert the "in flight" row. Returns (record, None) if this
+    request owns the key now, or (None, existing_record) if another
+    request got there first.
+
+    The unique constraint on (user, key) is what makes this safe when two
+    duplicates arrive at the same moment: only one INSERT can win.
+    """
+    now = timezone.now()
+    ttl = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+    lock_timeout = timedelta(
+        seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60))
+
+    # Every now and then, throw away expired keys so the table can't
+    # grow forever. (One indexed DELETE per ~100 keyed requests.)
+    if random.random() < 0.01:
+        IdempotencyKey.objects.filter(created_at__lt=now - ttl).delete()
+
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=fingerprint), None
+        except IntegrityError:
+            pass
+
+        existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if existing is None:
+            # Deleted between our INSERT and SELECT; just try again.
+            continue
+
+        if existing.created_at < now - ttl:
+            # Expired: forget it and try to take the key.
+            IdempotencyKey.objects.filter(pk=existing.pk).delete()
+            continue
+
+        if (existing.status_code is None
+                and existing.created_at < now - lock_timeout):
+            # The first request died without finishing (worker killed...).
+            # Take it over; the UPDATE only matches if nobody else did.
+            taken = IdempotencyKey.objects.filter(
+                pk=existing.pk,
+                created_at=existing.created_at,
+                status_code__isnull=True).update(created_at=now,
+                                                 fingerprint=fingerprint)
+            if taken:
+                existing.created_at, existing.fingerprint = now, fingerprint
+                return existing, None
+
+        return None, existing
+
+    return None, None
+
+
+def idempotent(view_method):
+    """
+    Decorator for viewset methods (create, update, custom actions).
+
+    Without an 'Idempotency-Key' header nothing changes. With one:
+      - first request: runs normally, and the response is stored.
+      - same key + same request again: the stored response is sent back
+        (with 'Idempotent-Replayed: true'). Order tables are not touched.
+      - same key while the first request is still running: 409.
+      - same key with a different body/path: 422.
+
+    5xx responses and exceptions are not stored, so the client can retry.
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            raise ValidationError({HEADER: 'Must be at most 255 characters.'})
+
+        fingerprint = request_fingerprint(request)
+        record, existing = _claim(request.user, key, fingerprint)
+
+        if record is None:
+            if existing is not None and existing.fingerprint != fingerprint:
+                raise IdempotencyKeyMismatch()
+            if existing is None or existing.status_code is None:
+                raise IdempotencyKeyInFlight()
+            return Response(existing.response_body,
+                            status=existing.status_code,
+                            headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            record.delete()
+        else:
+            record.status_code = response.status_code
+            record.response_body = response.data
+            record.save(update_fields=['status_code', 'response_body'])
+        return response
+
+    return wrapper
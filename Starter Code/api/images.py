@@ -0,0 +1,128 @@
+"""
+Product image renditions.
+
+When a product gets a new image we make smaller WebP copies of it
+(one per width in 'PRODUCT_IMAGE_WIDTHS') in a background job (api/jobs.py,
+run by 'manage.py run_jobs'), so the upload request doesn't wait for the
+resizing. The job is a row in the database, so a restart doesn't lose it.
+
+The files are named after a hash of the original image
+('product/renditions/<hash>-<width>.webp'). The same image always gets
+the same names and a new image always gets new ones, so the web server
+/ CDN can cache them "forever" ('Cache-Control: immutable'). When a
+product's image is replaced or removed, the old renditions are deleted,
+unless another product uses the same image. Deleting a product deletes
+its image and renditions the same way.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+from PIL import Image
+
+from api.changes import record_changes
+from api.jobs import enqueue
+from api.models import ChangeEvent, Product
+
+
+def rendition_name(digest, width):
+    return f'product/renditions/{digest[:20]}-{width}.webp'
+
+
+def make_renditions(image_name):
+    """
+    Creates the WebP renditions of the stored image 'image_name' and
+    returns {width: storage name}. Widths bigger than the original are
+    skipped (we never upscale). Files that already exist are reused.
+    """
+    with default_storage.open(image_name, 'rb') as f:
+        original = f.read()
+    digest = hashlib.sha256(original).hexdigest()
+
+    renditions = {}
+    with Image.open(io.BytesIO(original)) as image:
+        # For JPEGs, let the decoder skip detail we would throw away anyway
+        # (it can decode at 1/2, 1/4 or 1/8 size, never below what we ask).
+        biggest = max(settings.PRODUCT_IMAGE_WIDTHS)
+        image.draft('RGB', (biggest, biggest * image.height // image.width))
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in image.getbands()
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        # Biggest first, and each smaller one is made from the previous
+        # one: resizing 1200px -> 600px is much cheaper than 4000px -> 600px.
+        for width in sorted(settings.PRODUCT_IMAGE_WIDTHS, reverse=True):
+            if width > image.width:
+                continue
+            image = image.resize((width, width * image.height // image.width),
+                                 Image.LANCZOS)
+            name = rendition_name(digest, width)
+            if not default_storage.exists(name):
+                buffer = io.BytesIO()
+                image.save(buffer, 'WEBP', quality=80, method=4)
+                # 'save' may return a different name if the file showed
+                # up in the meantime; that's fine, it has the same content.
+                name = default_storage.save(name,
+                                            ContentFile(buffer.getvalue()))
+            renditions[str(width)] = name
+    return renditions
+
+
+def process_product_image(product_id, image_name):
+    """
+    Makes the renditions and stores them on the product, unless the
+    product's image was changed again in the meantime. The renditions
+    they replace are deleted.
+    """
+    renditions = make_renditions(image_name)
+    old = Product.objects.filter(pk=product_id).values_list(
+        'image_renditions', flat=True).first() or {}
+    # The UPDATE comes first in the transaction: on SQLite a transaction
+    # that reads and then writes fails ("database is locked") if another
+    # worker wrote in between.
+    with transaction.atomic():
+        updated = Product.objects.filter(
+            pk=product_id,
+            image=image_name).update(image_renditions=renditions)
+        if updated:
+            # '.update()' skips signals; tell the change feed ourselves.
+            record_changes(Product, [product_id], ChangeEvent.Actions.UPDATE)
+            superseded = set(old.values()) - set(renditions.values())
+        else:
+            # A newer image (or none) replaced this one: our files may
+            # not be needed by anyone.
+            superseded = set(renditions.values())
+        if superseded:
+            transaction.on_commit(lambda: delete_renditions(superseded))
+
+
+def delete_renditions(names):
+    """
+    Deletes the files 'names' (renditions, or original images) that no
+    product refers to.
+
+    The same image uploaded for two products shares its renditions, so
+    each name is checked first. (A product whose job is making the very
+    same files right now can still lose them; uploading its image again
+    brings them back.)
+    """
+    products = Product.objects.annotate(
+        renditions_text=Cast('image_renditions', TextField()))
+    for name in names:
+        if not products.filter(
+                Q(image=name) | Q(renditions_text__contains=name)).exists():
+            default_storage.delete(name)
+
+
+def schedule_renditions(product):
+    """
+    Queues the rendition job for 'product'. The job is part of the
+    current transaction, so workers only see it (and the new image)
+    once it commits.
+    """
+    enqueue(process_product_image, args=[product.pk, product.image.name])
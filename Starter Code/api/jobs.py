@@ -0,0 +1,236 @@
+"""
+A small background job queue that lives in the database ('Job' table).
+
+    from api.jobs import enqueue
+    enqueue('api.images.process_product_image', args=[product.pk, name])
+
+The job is just a row; 'manage.py run_jobs' workers claim due jobs, call
+the function and retry failures later with exponential backoff.
+
+Claiming: on databases with 'SELECT ... FOR UPDATE SKIP LOCKED'
+(PostgreSQL, MySQL 8) workers simply skip rows another worker has locked.
+SQLite has no row locks, so there a worker picks some due jobs and then
+claims them with a conditional UPDATE ('... WHERE status = queued'):
+if another worker was faster, the row doesn't match any more and we
+don't get it. Either way a job is never run twice at the same time.
+"""
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, args=(), kwargs=None, delay=0, max_attempts=None):
+    """
+    Adds a job that calls 'task' (a function or its dotted path) with
+    'args'/'kwargs' (must be JSON-serializable), 'delay' seconds from now.
+
+    Call it inside the transaction that makes the job necessary: if that
+    transaction rolls back, the job is gone too.
+    """
+    if callable(task):
+        task = f'{task.__module__}.{task.__qualname__}'
+    return Job.objects.create(
+        task=task,
+        args=list(args),
+        kwargs=kwargs or {},
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS)
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before the next try after 'attempts' failed ones:
+    doubles every time, up to 'JOBS_RETRY_MAX_DELAY', with some jitter
+    so jobs that failed together don't all come back together.
+    """
+    delay = min(settings.JOBS_RETRY_BASE_DELAY * 2**(attempts - 1),
+                settings.JOBS_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def due_jobs():
+    """Queued jobs whose time has come, oldest first."""
+    return Job.objects.filter(status=Job.Status.QUEUED,
+                              run_at__lte=timezone.now()).order_by('run_at')
+
+
+def claim_jobs(limit):
+    """
+    Marks up to 'limit' due jobs as running for this worker and returns
+    them (oldest 'run_at' first).
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = due_jobs()
+
+    def take(ids):
+        # The 'status' condition matters on SQLite only: a job another
+        # worker claimed since we read it doesn't match any more.
+        return Job.objects.filter(pk__in=ids,
+                                  status=Job.Status.QUEUED).update(
+                                      status=Job.Status.RUNNING,
+                                      claimed_by=token,
+                                      started_at=now,
+                                      attempts=F('attempts') + 1)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            locked = due.select_for_update(skip_locked=True)
+            claimed = take(list(locked.values_list('pk', flat=True)[:limit]))
+    else:
+        # No transaction on purpose: in SQLite a transaction that reads
+        # and then writes fails with "database is locked" if another
+        # worker wrote in between, while a lone UPDATE waits its turn.
+        claimed = take(list(due.values_list('pk', flat=True)[:limit]))
+    if not claimed:
+        return []
+    return list(Job.objects.filter(claimed_by=token).order_by('run_at'))
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records the outcome: done, queued again for
+    a retry, or failed for good.
+    """
+    # Only touch the row while it is still ours (see 'requeue_stale').
+    mine = Job.objects.filter(pk=job.pk, claimed_by=job.claimed_by)
+    try:
+        import_string(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error('Job %s (%s) failed for good after %s attempts:\n%s',
+                         job.pk, job.task, job.attempts, error)
+            mine.update(status=Job.Status.FAILED,
+                        last_error=error,
+                        finished_at=timezone.now())
+        else:
+            delay = retry_delay(job.attempts)
+            logger.warning('Job %s (%s) failed, retrying in %.0fs:\n%s',
+                           job.pk, job.task, delay, error)
+            mine.update(status=Job.Status.QUEUED,
+                        last_error=error,
+                        run_at=timezone.now() + timedelta(seconds=delay),
+                        claimed_by='')
+        return False
+
+    finished_at = timezone.now()
+    mine.update(status=Job.Status.DONE, finished_at=finished_at)
+    logger.info('Job %s (%s) done: waited %.3fs, ran %.3fs', job.pk,
+                job.task, (job.started_at - job.run_at).total_seconds(),
+                (finished_at - job.started_at).total_seconds())
+    return True
+
+
+def execute_job(job_id):
+    """
+    Entry point for worker threads/processes: loads the claimed job and
+    runs it, with a fresh database connection.
+    """
+    close_old_connections()
+    try:
+        run_job(Job.objects.get(pk=job_id))
+    finally:
+        close_old_connections()
+
+
+def requeue_stale(timeout=None):
+    """
+    Puts back jobs that have been "running" for longer than 'timeout'
+    seconds (their worker probably died). Jobs out of attempts are
+    marked as failed instead. Returns how many jobs were touched.
+    """
+    timeout = settings.JOBS_TIMEOUT if timeout is None else timeout
+    stale = Job.objects.filter(status=Job.Status.RUNNING,
+                               started_at__lt=timezone.now() -
+                               timedelta(seconds=timeout))
+    error = f'Still running after {timeout}s, worker presumed dead.'
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.FAILED,
+        last_error=error,
+        finished_at=timezone.now(),
+        claimed_by='')
+    requeued = stale.update(status=Job.Status.QUEUED,
+                            last_error=error,
+                            run_at=timezone.now(),
+                            claimed_by='')
+    return failed + requeued
+
+
+def delete_finished(older_than):
+    """
+    Deletes done jobs that finished more than 'older_than' seconds ago.
+    Failed jobs are kept until someone has looked at them.
+    """
+    return Job.objects.filter(
+        status=Job.Status.DONE,
+        finished_at__lt=timezone.now() -
+        timedelta(seconds=older_than)).delete()[0]
+
+
+def _percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def queue_stats(window=300):
+    """
+    Numbers to keep an eye on the queue with:
+
+    - 'depth': jobs per status, with 'queued' split into 'due' (waiting
+      for a worker) and 'scheduled' (retries / delayed jobs);
+    - 'oldest_due_seconds': how long the oldest due job has been waiting
+      (if this keeps growing, add workers);
+    - 'wait' / 'run': p50/p95/max seconds that jobs finished in the last
+      'window' seconds waited for a worker and took to run.
+    """
+    now = timezone.now()
+    depth = dict.fromkeys(Job.Status.values, 0)
+    depth.update(
+        Job.objects.values_list('status').annotate(Count('pk')).order_by())
+    due = due_jobs()
+    oldest = due.aggregate(oldest=Min('run_at'))['oldest']
+    depth['due'] = due.count()
+    depth['scheduled'] = depth['queued'] - depth['due']
+
+    # Durations are computed here rather than in SQL, because date
+    # arithmetic differs too much between databases.
+    recent = Job.objects.filter(status=Job.Status.DONE,
+                                finished_at__gte=now -
+                                timedelta(seconds=window)).values_list(
+                                    'run_at', 'started_at', 'finished_at')
+    waits, runs = [], []
+    for run_at, started_at, finished_at in recent[:10000]:
+        waits.append(max((started_at - run_at).total_seconds(), 0))
+        runs.append((finished_at - started_at).total_seconds())
+
+    def summary(values):
+        if not values:
+            return None
+        values.sort()
+        return {
+            'p50': round(_percentile(values, 0.5), 3),
+            'p95': round(_percentile(values, 0.95), 3),
+            'max': round(values[-1], 3),
+        }
+
+    return {
+        'depth': depth,
+        'oldest_due_seconds':
+        round((now - oldest).total_seconds(), 3) if oldest else 0,
+        'window_seconds': window,
+        'done_in_window': len(runs),
+        'wait': summary(waits),
+        'run': summary(runs),
+    }
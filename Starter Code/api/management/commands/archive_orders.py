@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = ('Moves confirmed/cancelled orders older than --days into the '
+            'archive tables. With --every, keeps running on a schedule.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days',
+                            type=int,
+                            default=settings.ARCHIVE_ORDERS_AFTER_DAYS)
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=500,
+                            help='Orders moved per transaction')
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=None,
+            help='Run again every N seconds (scheduled mode) until stopped')
+
+    def handle(self, *args, **options):
+        while True:
+            moved = archive_orders(options['days'], options['batch_size'])
+            self.stdout.write(f'Archived {moved} order(s).')
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
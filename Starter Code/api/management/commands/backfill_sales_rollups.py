@@ -0,0 +1,58 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from api.models import ArchivedOrder, Order
+from api.rollups import rebuild_days, sale_day
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the daily sales rollups from the orders (archive '
+            'included), a few days per transaction. Use it once to fill '
+            'in history, or to repair a date range.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start',
+                            type=date.fromisoformat,
+                            help='First day (default: the oldest order)')
+        parser.add_argument('--end',
+                            type=date.fromisoformat,
+                            help='Last day (default: today)')
+        parser.add_argument('--chunk-days',
+                            type=int,
+                            default=7,
+                            help='Days recomputed per transaction')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        start = options['start']
+        if start is None:
+            oldest = [
+                created_at for created_at in (
+                    model.objects.aggregate(oldest=Min('created_at'))['oldest']
+                    for model in (Order, ArchivedOrder))
+                if created_at is not None
+            ]
+            if not oldest:
+                self.stdout.write('No orders, nothing to do.')
+                return
+            start = sale_day(min(oldest))
+        if start > end:
+            raise CommandError('--start must not be after --end.')
+
+        # Short transactions: orders keep flowing in while this runs, and
+        # only the rows of the current chunk are locked.
+        rows = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(
+                chunk_start + timedelta(days=options['chunk_days'] - 1), end)
+            rows += rebuild_days(chunk_start, chunk_end)
+            self.stdout.write(f'{chunk_start} .. {chunk_end}: done')
+            chunk_start = chunk_end + timedelta(days=1)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rebuilt {start} .. {end}: {rows} product/day/status rows.'))
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.middleware import BrotliCodec, GzipCodec, ZstdCodec, brotli, zstandard
+from api.models import User
+
+ENDPOINTS = ['/product/info/', '/orders/', '/api/users/']
+
+
+class Command(BaseCommand):
+    help = ('Shows the CPU time vs bytes-on-the-wire trade-off of each '
+            'compression codec for our real endpoints.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', nargs='+', default=ENDPOINTS)
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=50,
+                            help='Compressions timed per codec/level')
+
+    def codecs(self):
+        codecs = [GzipCodec(level) for level in (1, 6, 9)]
+        if brotli is not None:
+            codecs += [BrotliCodec(level) for level in (1, 4, 11)]
+        if zstandard is not None:
+            codecs += [ZstdCodec(level) for level in (1, 3, 10)]
+        return codecs
+
+    def fetch(self, path, user):
+        """
+        Calls the view directly (no middleware), so we get the raw,
+        uncompressed JSON exactly as the API produces it.
+        """
+        request = APIRequestFactory().get(path, HTTP_ACCEPT='application/json')
+        force_authenticate(request, user=user)
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        response.render()
+        return response.content
+
+    def handle(self, *args, **options):
+        # A staff user sees every order and may list users.
+        user = User.objects.filter(is_staff=True).first()
+        if user is None:
+            raise CommandError(
+                'No staff user found. Run "manage.py populate_db" first.')
+
+        if brotli is None:
+            self.stdout.write('brotli not installed, skipping it.')
+        if zstandard is None:
+            self.stdout.write('zstandard not installed, skipping it.')
+
+        for path in options['endpoints']:
+            body = self.fetch(path, user)
+            self.stdout.write(f'\n{path}  ({len(body):,} bytes uncompressed)')
+            self.stdout.write(f"  {'codec':<8} {'level':>5} {'bytes':>10} "
+                              f"{'ratio':>6} {'ms/resp':>8} {'MB/s':>8}")
+            for codec in self.codecs():
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    compressed = codec.compress(body)
+                elapsed = (time.perf_counter() - start) / options['repeat']
+                self.stdout.write(
+                    f'  {codec.name:<8} {codec.level:>5} '
+                    f'{len(compressed):>10,} '
+                    f'{len(body) / len(compressed):>6.1f} '
+                    f'{elapsed * 1e3:>8.3f} '
+                    f'{len(body) / elapsed / 1e6 if elapsed else 0:>8.1f}')
@@ -0,0 +1,100 @@
+import io
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image
+
+from api import changes
+from api.models import Job, Product
+
+
+def random_jpeg(width, height):
+    # Noise with some big blocks in it, so it compresses like a photo-ish
+    # image rather than a flat colour.
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    for _ in range(20):
+        box = [random.randrange(width), random.randrange(height)]
+        box += [box[0] + width // 4, box[1] + height // 4]
+        image.paste(tuple(random.randrange(256) for _ in range(3)), box)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = ('Measures how long a product image upload takes in the request '
+            '(save + queue the job) and how many images per second the '
+            'job workers turn into renditions. Other due jobs in the queue '
+            'are run too.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=20)
+        parser.add_argument('--size',
+                            default='2400x1600',
+                            help='WIDTHxHEIGHT of the uploaded images')
+        parser.add_argument('--workers',
+                            type=int,
+                            default=settings.JOBS_WORKERS)
+
+    def handle(self, *args, **options):
+        width, height = (int(v) for v in options['size'].split('x'))
+        uploads = [
+            random_jpeg(width, height) for _ in range(options['images'])
+        ]
+        average_kib = statistics.mean(map(len, uploads)) / 1024
+        self.stdout.write(f"{len(uploads)} images of {width}x{height}, "
+                          f"avg {average_kib:.0f} KiB, "
+                          f"{options['workers']} worker(s)")
+
+        # Keep the benchmark's files and rows out of the real data.
+        # (The workers are threads of this process, so they see the
+        # temporary MEDIA_ROOT too.)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root), changes.paused():
+            last_job = Job.objects.order_by('-pk').values_list(
+                'pk', flat=True).first() or 0
+            products = []
+            upload_times = []
+            start = time.perf_counter()
+            for i, data in enumerate(uploads):
+                t = time.perf_counter()
+                product = Product(name=f'bench {i}',
+                                  description='',
+                                  price=1,
+                                  stock=1)
+                product.image.save(f'bench-{i}.jpg',
+                                   ContentFile(data),
+                                   save=False)
+                product.save()
+                upload_times.append(time.perf_counter() - t)
+                products.append(product)
+
+            call_command('run_jobs',
+                         workers=options['workers'],
+                         once=True,
+                         stats_every=0,
+                         stdout=io.StringIO())
+            elapsed = time.perf_counter() - start
+
+            done = Product.objects.filter(
+                pk__in=[p.pk for p in products]).exclude(
+                    image_renditions={}).count()
+            Product.objects.filter(pk__in=[p.pk for p in products]).delete()
+            Job.objects.filter(pk__gt=last_job,
+                               task__startswith='api.images.').delete()
+
+        upload_times.sort()
+        p50 = upload_times[len(upload_times) // 2]
+        self.stdout.write(f'upload latency: p50 {p50 * 1e3:.1f} ms, '
+                          f'max {upload_times[-1] * 1e3:.1f} ms')
+        self.stdout.write(
+            f'processed {done}/{len(uploads)} in {elapsed:.2f}s '
+            f'= {done / elapsed:.1f} images/s '
+            f'({len(settings.PRODUCT_IMAGE_WIDTHS)} renditions each)')
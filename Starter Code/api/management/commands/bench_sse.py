@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from api.events import InProcessBroker
+from api.models import User
+from api.views import order_event_stream
+
+
+class Command(BaseCommand):
+    help = ('Opens many order event streams in one event loop (like one '
+            'ASGI worker) and measures memory per stream and how long it '
+            'takes an event to reach every stream.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--streams',
+                            nargs='+',
+                            type=int,
+                            default=[100, 1000, 5000])
+        parser.add_argument('--events',
+                            type=int,
+                            default=50,
+                            help='Events published per run')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'streams':>8} {'KiB/stream':>11} "
+                          f"{'fan-out p50 ms':>15} {'fan-out p95 ms':>15}")
+        for count in options['streams']:
+            kib, latencies = asyncio.run(self.run(count, options['events']))
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1e3
+            p95 = latencies[int(len(latencies) * 0.95)] * 1e3
+            self.stdout.write(
+                f'{count:>8} {kib:>11.1f} {p50:>15.2f} {p95:>15.2f}')
+
+    async def run(self, count, events):
+        broker = InProcessBroker()
+        # Staff users receive every event, the worst case for fan-out.
+        user = User(pk=1, username='bench', is_staff=True)
+        received = {}  # event id -> [publish time, streams still waiting]
+        latencies = []
+        done = asyncio.Event()
+
+        async def consume(stream):
+            await anext(stream)  # the 'retry:' line
+            async for chunk in stream:
+                if not chunk.startswith('id: '):
+                    continue
+                event_id = chunk[4:chunk.index('\n')]
+                entry = received[event_id]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    # The last stream got it: that's the fan-out time.
+                    latencies.append(time.perf_counter() - entry[0])
+                    if len(latencies) == events:
+                        done.set()
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        streams = [
+            order_event_stream(user, broker.subscribe(), heartbeat=60)
+            for _ in range(count)
+        ]
+        tasks = [asyncio.create_task(consume(s)) for s in streams]
+        await asyncio.sleep(0)  # let every consumer start waiting
+        kib = (tracemalloc.get_traced_memory()[0] - before) / count / 1024
+        tracemalloc.stop()
+
+        def publisher():
+            # Publishes from another thread, like a sync view would.
+            for i in range(events):
+                event_id = str(i + 1)
+                received[event_id] = [time.perf_counter(), count]
+                broker.publish({'order_id': event_id, 'user_id': 1})
+                time.sleep(0.005)
+
+        await asyncio.to_thread(publisher)
+        await done.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return kib, latencies
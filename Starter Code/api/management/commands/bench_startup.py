@@ -0,0 +1,118 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# This little script runs in a *fresh* Python process for every profile,
+# so nothing is already imported or cached from the current process.
+# It prints one line of JSON with the numbers back to the parent.
+CHILD_SCRIPT = r'''
+import io, json, sys, time
+
+t0 = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+app = get_wsgi_application()
+boot = time.perf_counter() - t0
+
+from django.conf import settings
+
+def start_response(status, headers, exc_info=None):
+    start_response.status = status
+
+def call(path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost', 'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+    }
+    response = app(environ, start_response)
+    b''.join(response)
+    response.close()
+
+path, requests = sys.argv[1], int(sys.argv[2])
+call(path)  # warm-up (first request imports the views, urls, ...)
+timings = []
+for _ in range(requests):
+    t = time.perf_counter()
+    call(path)
+    timings.append(time.perf_counter() - t)
+
+print(json.dumps({
+    'boot': boot,
+    'modules': len(sys.modules),
+    'middleware': len(settings.MIDDLEWARE),
+    'apps': len(settings.INSTALLED_APPS),
+    'status': start_response.status,
+    'timings': timings,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Compares worker boot time and per-request middleware overhead '
+            'of the settings profiles (run "migrate" first).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles',
+                            nargs='+',
+                            default=['dev', 'prod'],
+                            help='Modules inside drf_course.settings')
+        parser.add_argument('--runs',
+                            type=int,
+                            default=5,
+                            help='Fresh processes started per profile')
+        parser.add_argument('--requests',
+                            type=int,
+                            default=200,
+                            help='Requests timed inside each process')
+        parser.add_argument(
+            '--path',
+            default='/__bench__/',
+            help='URL to request. The default 404s, so we measure the '
+            'middleware + URL resolving without any view or query.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'profile':<8} {'boot ms':>9} {'modules':>8} {'apps':>5} "
+            f"{'mw':>3} {'req us (p50)':>13} {'req us (p95)':>13}  status")
+
+        for profile in options['profiles']:
+            env = {
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': f'drf_course.settings.{profile}',
+                # prod refuses to start without these
+                'DJANGO_SECRET_KEY': os.environ.get('DJANGO_SECRET_KEY',
+                                                    'bench-only-secret'),
+                'DJANGO_ALLOWED_HOSTS': 'localhost',
+            }
+            boots, timings = [], []
+            for _ in range(options['runs']):
+                proc = subprocess.run(
+                    [
+                        sys.executable, '-c', CHILD_SCRIPT, options['path'],
+                        str(options['requests'])
+                    ],
+                    cwd=settings.BASE_DIR,
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+                boots.append(result['boot'])
+                timings.extend(result['timings'])
+
+            timings.sort()
+            p50 = timings[len(timings) // 2] * 1e6
+            p95 = timings[int(len(timings) * 0.95)] * 1e6
+            self.stdout.write(
+                f"{profile:<8} {statistics.median(boots) * 1e3:>9.1f} "
+                f"{result['modules']:>8} {result['apps']:>5} "
+                f"{result['middleware']:>3} {p50:>13.0f} {p95:>13.0f}  "
+                f"{result['status']}")
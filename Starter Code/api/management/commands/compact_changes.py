@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from api.models import ChangeEvent
+
+
+class Command(BaseCommand):
+    help = ('Compacts the change feed: for events older than --days, only '
+            'the newest event of each object is kept.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days',
+                            type=int,
+                            default=7,
+                            help='Only compact events older than this')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        # An event is "superseded" if the same object has a newer event.
+        # Consumers that are further behind still get that newer event, so
+        # they end up with the same (latest) state of the object.
+        newer = ChangeEvent.objects.filter(model=OuterRef('model'),
+                                           object_id=OuterRef('object_id'),
+                                           seq__gt=OuterRef('seq'))
+        superseded = ChangeEvent.objects.filter(
+            created_at__lt=cutoff).filter(Exists(newer))
+
+        # Delete in batches so we never hold a long lock on the table.
+        deleted = 0
+        while True:
+            batch = list(
+                superseded.values_list('seq',
+                                       flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            ChangeEvent.objects.filter(seq__in=batch).delete()
+            deleted += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Removed {deleted} superseded events.'))
@@ -0,0 +1,72 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import User, UserOrderSummary
+from api.rollups import actual_order_summaries
+
+# What the summary of a user without orders looks like.
+NO_ORDERS = {
+    'pending_orders': 0,
+    'confirmed_orders': 0,
+    'cancelled_orders': 0,
+    'spent': Decimal('0.00'),
+    'last_order_at': None,
+}
+
+
+class Command(BaseCommand):
+    help = ('Compares every user order summary with the orders themselves '
+            'and reports the differences. With --fix, repairs them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=1000,
+                            help='Users checked per transaction')
+
+    def handle(self, *args, **options):
+        drifted = 0
+        last_pk = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+                    'pk', flat=True)[:options['batch_size']])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+            with transaction.atomic():
+                # Lock the stored rows first: order writes that would
+                # change them wait until we're done, and are then applied
+                # on top of the repaired numbers.
+                stored = UserOrderSummary.objects.select_for_update().in_bulk(
+                    user_ids)
+                actual = actual_order_summaries(user_ids)
+                for user_id in user_ids:
+                    summary = stored.get(user_id)
+                    if summary is None and user_id not in actual:
+                        continue  # no orders, no summary: fine
+                    if summary is None:
+                        summary = UserOrderSummary(user_id=user_id)
+                    expected = actual.get(user_id, NO_ORDERS)
+                    diff = {
+                        field: (getattr(summary, field), want)
+                        for field, want in expected.items()
+                        if getattr(summary, field) != want
+                    }
+                    if not diff:
+                        continue
+                    drifted += 1
+                    self.stdout.write(f'user {user_id}: ' + ', '.join(
+                        f'{field} {have} != {want}'
+                        for field, (have, want) in diff.items()))
+                    if options['fix']:
+                        for field, (_, want) in diff.items():
+                            setattr(summary, field, want)
+                        summary.save()
+
+        action = 'Repaired' if options['fix'] else 'Found'
+        self.stdout.write(
+            self.style.SUCCESS(f'{action} {drifted} drifted summaries.'))
@@ -0,0 +1,138 @@
+import json
+import multiprocessing
+import signal
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import jobs
+from api.processes import init_worker
+
+
+class Command(BaseCommand):
+    help = ('Runs background jobs from the database queue (api/jobs.py) '
+            'until stopped with Ctrl+C / SIGTERM.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+                            type=int,
+                            default=settings.JOBS_WORKERS,
+                            help='Jobs run at the same time (0 = one at a '
+                            'time in this process, no pool)')
+        parser.add_argument(
+            '--pool',
+            choices=['thread', 'process'],
+            default='thread',
+            help='Threads suit jobs that mostly wait (I/O, Pillow); use '
+            'processes for pure-Python CPU work')
+        parser.add_argument('--poll-interval',
+                            type=float,
+                            default=settings.JOBS_POLL_INTERVAL,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stats-every',
+                            type=int,
+                            default=60,
+                            help='Print queue stats every N seconds (0 = no)')
+        parser.add_argument('--once',
+                            action='store_true',
+                            help='Exit when no job is due instead of waiting')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Finish the running jobs, then exit (instead of dying mid-job and
+        # leaving them to 'requeue_stale').
+        previous_handlers = {
+            signum: signal.signal(signum, self.stop)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        workers = options['workers']
+        executor = None
+        if workers:
+            if options['pool'] == 'process':
+                # 'spawn', not 'fork': forked workers are started at the
+                # first 'submit()', when the parent has an open database
+                # connection again, and would share its socket. Spawned
+                # ones start from scratch and set Django up themselves.
+                executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_worker)
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers,
+                                              thread_name_prefix='jobs')
+
+        running = set()
+        next_housekeeping = next_stats = time.monotonic()
+        try:
+            while not self.stopping:
+                now = time.monotonic()
+                if now >= next_housekeeping:
+                    self.housekeeping()
+                    next_housekeeping = now + 60
+                if options['stats_every'] and now >= next_stats:
+                    self.print_stats()
+                    next_stats = now + options['stats_every']
+
+                running = self.collect(running)
+                if executor is None:
+                    claimed = jobs.claim_jobs(1)
+                    for job in claimed:
+                        jobs.run_job(job)
+                elif len(running) < workers:
+                    # Only claim what we can start right away; the rest
+                    # stays in the queue for other workers.
+                    claimed = jobs.claim_jobs(workers - len(running))
+                    running |= {
+                        executor.submit(jobs.execute_job, job.pk)
+                        for job in claimed
+                    }
+                else:
+                    claimed = []
+
+                if claimed:
+                    continue
+                # (Nothing claimed can also mean another worker was faster.)
+                if options['once'] and not running and not jobs.due_jobs(
+                ).exists():
+                    break
+                if running:
+                    wait(running,
+                         timeout=options['poll_interval'],
+                         return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(options['poll_interval'])
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+                self.collect(running)
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        self.print_stats()
+
+    def stop(self, signum, frame):
+        self.stdout.write('Stopping after the running jobs finish...')
+        self.stopping = True
+
+    def collect(self, running):
+        """Drops finished futures, reporting any that crashed."""
+        finished = {f for f in running if f.done()}
+        for future in finished:
+            if future.exception() is not None:
+                # 'run_job' handles errors of the job itself; this is
+                # the worker machinery failing (e.g. database gone).
+                self.stderr.write(f'Worker error: {future.exception()!r}')
+        return running - finished
+
+    def housekeeping(self):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(
+                self.style.WARNING(f'Took back {requeued} stale job(s).'))
+        jobs.delete_finished(settings.JOBS_KEEP_DONE)
+
+    def print_stats(self):
+        self.stdout.write(json.dumps(jobs.queue_stats()))
@@ -0,0 +1,217 @@
+import gzip
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+# brotli and zstandard are optional. If they are not installed we simply
+# don't offer them and fall back to gzip (which is in the standard library).
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+# Only text-like bodies are worth compressing. Images, zips, etc. are
+# already compressed and would just burn CPU. Event streams (SSE) are
+# text too, but every event would need its own flush: they are sent
+# as-is, so they arrive right away.
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/(?!event-stream)|'
+    r'application/(json|javascript|xml|[\w.+-]+\+json|[\w.+-]+\+xml))')
+
+
+class GzipCodec:
+    name = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        # mtime=0 keeps the output identical for identical input.
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def compressor(self):
+        # wbits=31 -> zlib with a gzip header/trailer.
+        obj = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return (obj.compress, lambda: obj.flush(zlib.Z_SYNC_FLUSH),
+                obj.flush)
+
+
+class BrotliCodec:
+    name = 'br'
+
+    def __init__(self, level=4):
+        self.level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def compressor(self):
+        obj = brotli.Compressor(quality=self.level)
+        return obj.process, obj.flush, obj.finish
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressor(self):
+        obj = zstandard.ZstdCompressor(level=self.level).compressobj()
+        return (obj.compress,
+                lambda: obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+                obj.flush)
+
+
+# Server preference order, used to break ties between equal 'q' values.
+CODECS = {'br': BrotliCodec, 'zstd': ZstdCodec, 'gzip': GzipCodec}
+
+
+def available_codecs():
+    """
+    Returns the codecs we can actually use, in preference order.
+    'COMPRESSION_ENCODINGS' can narrow or reorder the list and
+    'COMPRESSION_LEVELS' can tune them, e.g. {'gzip': 9}.
+    """
+    installed = {'br': brotli, 'zstd': zstandard, 'gzip': gzip}
+    names = getattr(settings, 'COMPRESSION_ENCODINGS', list(CODECS))
+    levels = getattr(settings, 'COMPRESSION_LEVELS', {})
+    codecs = []
+    for name in names:
+        if name not in CODECS or installed[name] is None:
+            continue
+        if name in levels:
+            codecs.append(CODECS[name](levels[name]))
+        else:
+            codecs.append(CODECS[name]())
+    return codecs
+
+
+def parse_accept_encoding(header):
+    """
+    Turns 'gzip;q=0.8, br, *;q=0.1' into {'gzip': 0.8, 'br': 1.0, '*': 0.1}.
+    """
+    weights = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    return weights
+
+
+def choose_codec(header, codecs):
+    """
+    Picks the codec the client likes best ('q' value). On a tie we keep
+    our own preference order. Returns None if nothing is acceptable.
+    """
+    weights = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for codec in codecs:
+        q = weights.get(codec.name, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+def _compress_stream(chunks, codec):
+    compress, flush, finish = codec.compressor()
+    for chunk in chunks:
+        # Flush after every chunk so the client gets data as soon as we
+        # have it instead of waiting for the compressor's buffer to fill.
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+async def _compress_async_stream(chunks, codec):
+    compress, flush, finish = codec.compressor()
+    async for chunk in chunks:
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with brotli, zstd or gzip depending on what the
+    client sent in 'Accept-Encoding' and what is installed on the server.
+
+    - Bodies smaller than 'COMPRESSION_MIN_SIZE' bytes are sent as-is
+      (the headers would cost more than we save).
+    - 'StreamingHttpResponse' bodies are compressed chunk by chunk, so
+      they stay streaming.
+    - Responses that already have a 'Content-Encoding', are not text, or
+      say 'Cache-Control: no-transform' are left alone.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.codecs = available_codecs()
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 512)
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not COMPRESSIBLE_TYPES.match(content_type):
+            return response
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        # From here on the body *could* be compressed, so caches must
+        # know the answer depends on Accept-Encoding.
+        patch_vary_headers(response, ('Accept-Encoding', ))
+
+        codec = choose_codec(request.META.get('HTTP_ACCEPT_ENCODING', ''),
+                             self.codecs)
+        if codec is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _compress_async_stream(
+                    response.streaming_content, codec)
+            else:
+                response.streaming_content = _compress_stream(
+                    response.streaming_content, codec)
+            # We don't know the compressed length in advance.
+            del response.headers['Content-Length']
+        else:
+            compressed = codec.compress(response.content)
+            # Tiny or random bodies can grow when compressed.
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The bytes changed, so a strong ETag is not valid any more.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+
+        response.headers['Content-Encoding'] = codec.name
+        return response
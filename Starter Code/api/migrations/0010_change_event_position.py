@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:22
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_events(apps, schema_editor):
+    # Events from before numbering keep their 'seq' as position, so the
+    # tokens consumers already have stay valid.
+    ChangeEvent = apps.get_model('api', 'ChangeEvent')
+    ChangeFeedState = apps.get_model('api', 'ChangeFeedState')
+    ChangeEvent.objects.update(position=F('seq'))
+    last = ChangeEvent.objects.aggregate(last=Max('seq'))['last']
+    ChangeFeedState.objects.create(pk=1, last_position=last or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_userordersummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeFeedState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_position', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='changeevent',
+            name='position',
+            field=models.BigIntegerField(editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(number_existing_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_product_details(apps, schema_editor):
+    # Archived so far: the best we have is the product's current name
+    # and price.
+    ArchivedOrderItem = apps.get_model('api', 'ArchivedOrderItem')
+    Product = apps.get_model('api', 'Product')
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    ArchivedOrderItem.objects.update(
+        product_name=Subquery(product.values('name')[:1]),
+        unit_price=Subquery(product.values('price')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_change_event_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='product_name',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='api.product'),
+        ),
+        migrations.RunPython(copy_product_details, migrations.RunPython.noop),
+    ]
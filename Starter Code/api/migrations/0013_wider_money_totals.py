@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_orderitem_unit_price'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productsalesdaily',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=24),
+        ),
+        migrations.AlterField(
+            model_name='salesdaily',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=24),
+        ),
+        migrations.AlterField(
+            model_name='userordersummary',
+            name='spent',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=24),
+        ),
+    ]
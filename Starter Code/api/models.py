@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 import uuid  # Used for creating unique order IDs
 
 
@@ -37,6 +39,11 @@ class Product(models.Model):
     # 'upload_to=' specifies the sub-directory in your 'media' folder.
     image = models.ImageField(upload_to='product/', blank=True, null=True)
 
+    # Smaller WebP versions of 'image', made in the background after an
+    # upload (see api/images.py): {"200": "product/renditions/....webp"}.
+    # Empty until they are ready.
+    image_renditions = models.JSONField(default=dict, blank=True)
+
     @property
     def in_stock(self):
         """
@@ -97,6 +104,15 @@ class Order(models.Model):
                                      through="OrderItem",
                                      related_name='orders')
 
+    class Meta:
+        # Orders are mostly looked up by status and/or date (admin
+        # filters, 'OrderFilter'), so index those columns.
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='order_status_created_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.order_id} by {self.user.username}"
 
@@ -116,19 +132,336 @@ class OrderItem(models.Model):
                               on_delete=models.CASCADE,
                               related_name='items')
 
+    # The biggest 'quantity' every database can store (a
+    # 'PositiveIntegerField' is a 32-bit column on PostgreSQL).
+    MAX_QUANTITY = 2**31 - 1
+
     # Links this item to the specific Product.
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
 
     # Stores how many of this product are in this order.
     quantity = models.PositiveIntegerField()
 
+    # The product's price when the item was added (filled in on save, see
+    # 'api/signals.py'). Prices change; what this order cost doesn't.
+    unit_price = models.DecimalField(max_digits=10,
+                                     decimal_places=2,
+                                     editable=False)
+
     @property
     def item_subtotal(self):
         """
         Another calculated property. This is the business logic
         for calculating the subtotal of this specific line item.
         """
-        return self.product.price * self.quantity
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        # 'self.order_id' is the raw foreign key value, so unlike
+        # 'self.order.order_id' it doesn't need a query to load the order.
+        return f"{self.quantity} * {self.product.name} in order {self.order_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Remembers the result of an order POST/PUT that was sent with an
+    'Idempotency-Key' header, so when the client retries (e.g. after a
+    timeout) we send back the *same* response instead of creating a
+    second order. See 'api/idempotency.py'.
+
+    Rows older than 'IDEMPOTENCY_KEY_TTL' are treated as gone and
+    deleted from time to time, so the table stays small.
+    """
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='+')
+
+    # The value of the header, chosen by the client (usually a UUID).
+    key = models.CharField(max_length=255)
+
+    # sha256 of method + path + body. The same key with a different
+    # request is a client bug and is rejected.
+    fingerprint = models.CharField(max_length=64)
+
+    # Both stay empty while the first request is still running
+    # ("in flight"). A duplicate arriving in that window gets a 409.
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True,
+                                     blank=True,
+                                     encoder=DjangoJSONEncoder)
+
+    # Indexed because we delete expired rows by date.
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    name='unique_idempotency_key_per_user')
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} ({self.user_id})"
+
+
+class ChangeEvent(models.Model):
+    """
+    One row per create/update/delete of a Product, Order or OrderItem.
+
+    This is the "change feed" behind '/changes/?since=<token>': a system
+    that wants to stay in sync (search index, ERP, offline app) remembers
+    the last 'seq' it saw and only asks for what happened after it,
+    instead of downloading every product and order again.
+    """
+
+    class Actions(models.TextChoices):
+        CREATE = 'create'
+        UPDATE = 'update'
+        DELETE = 'delete'
+        # The order (or item) was moved to 'ArchivedOrder' /
+        # 'ArchivedOrderItem' (see 'archive_orders').
+        ARCHIVE = 'archive'
+
+    # Always-increasing number, given when the row is inserted.
+    seq = models.BigAutoField(primary_key=True)
+
+    # The sync token: given by 'changes.number_events()' once the event
+    # is committed, so events are numbered in the order they became
+    # visible. (A slow transaction can commit a *smaller* 'seq' after a
+    # bigger one was already handed out; it still gets a bigger
+    # 'position'.) Empty until then.
+    position = models.BigIntegerField(null=True, unique=True, editable=False)
+
+    # 'product', 'order' or 'orderitem' and the primary key of the object
+    # (as text, because orders use UUIDs and the others integers).
+    model = models.CharField(max_length=20)
+    object_id = models.CharField(max_length=64)
+
+    action = models.CharField(max_length=10, choices=Actions.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Used by compaction to find older events of the same object.
+            models.Index(fields=['model', 'object_id', 'seq'],
+                         name='change_object_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.seq} {self.action} {self.model} {self.object_id}"
+
+
+class ChangeFeedState(models.Model):
+    """
+    A single row: the last 'position' given to a change event. Locked
+    while numbering, so only one 'number_events()' runs at a time.
+    """
+    last_position = models.BigIntegerField(default=0)
+
+
+class ArchivedOrder(models.Model):
+    """
+    "Cold" copy of an old, finished (confirmed or cancelled) Order.
+
+    'manage.py archive_orders' moves such orders out of the 'Order' table
+    into this one, so the table every request hits stays small. The
+    columns are the same as 'Order' (plus 'archived_at'); 'OrderViewSet'
+    reads from here only when a date filter reaches back far enough.
+    """
+    order_id = models.UUIDField(primary_key=True)
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='archived_orders')
+    # Copied from the original order, so no 'auto_now_add' here.
+    created_at = models.DateTimeField()
+    status = models.CharField(max_length=10,
+                              choices=Order.StatusChoices.choices)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'],
+                         name='archived_user_created_idx'),
+            models.Index(fields=['created_at'],
+                         name='archived_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.order_id}"
+
+
+class ArchivedOrderItem(models.Model):
+    """
+    An OrderItem of an 'ArchivedOrder'.
+
+    The product's name (and the item's price) are copied when the order
+    is archived, so the archive stays complete when a product is deleted
+    later (the product id is kept too, for the sales rollups).
+    """
+    order = models.ForeignKey(ArchivedOrder,
+                              on_delete=models.CASCADE,
+                              related_name='items')
+    product = models.ForeignKey(Product,
+                                on_delete=models.DO_NOTHING,
+                                db_constraint=False)
+    product_name = models.CharField(max_length=200, default='')
+    unit_price = models.DecimalField(max_digits=10,
+                                     decimal_places=2,
+                                     default=0)
+    quantity = models.PositiveIntegerField()
+
+    @property
+    def item_subtotal(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return (f"{self.quantity} * {self.product_id} "
+                f"in archived order {self.order_id}")
+
+
+class Job(models.Model):
+    """
+    One piece of background work: "call the function 'task' with 'args'
+    and 'kwargs'". Web requests add rows ('api.jobs.enqueue()'), and
+    'manage.py run_jobs' workers pick them up and run them.
+
+    Keeping the queue in the database means no extra service to run, and
+    a job added inside a transaction only exists if that transaction
+    commits (no "job for an order that was rolled back").
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        DONE = 'done'
+        # Gave up after 'max_attempts' tries; see 'last_error'.
+        FAILED = 'failed'
+
+    # Dotted path of the function, e.g. 'api.images.process_product_image'.
+    task = models.CharField(max_length=255)
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+
+    status = models.CharField(max_length=10,
+                              choices=Status.choices,
+                              default=Status.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+
+    # Not before this time. Moved forward when a failed job is retried.
+    run_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # Random value written by the worker that claimed the job, so it can
+    # find "its" jobs again and doesn't touch one that was taken away.
+    claimed_by = models.CharField(max_length=32, blank=True)
+
+    class Meta:
+        indexes = [
+            # "Queued jobs that are due, oldest first" is THE query.
+            models.Index(fields=['status', 'run_at'],
+                         name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} {self.task} ({self.status})"
+
+
+# Digits of the money totals below. One order item can be worth up to
+# 'OrderItem.MAX_QUANTITY' times the biggest price (20 digits); this
+# leaves room for ten thousand of those in one total.
+TOTAL_MAX_DIGITS = 24
+
+
+class ProductSalesDaily(models.Model):
+    """
+    Sales rollup: units sold and revenue of one product, on one day, for
+    orders in one status. Kept up to date as orders are written (see
+    'api/rollups.py'), so sales reports read a few rows per day instead
+    of scanning every OrderItem.
+
+    The day is the local date the order was created. Revenue uses the
+    price the item was ordered at ('OrderItem.unit_price').
+    """
+    day = models.DateField()
+    # No database constraint: past sales stay in the rollup even if the
+    # product is deleted later.
+    product = models.ForeignKey(Product,
+                                on_delete=models.DO_NOTHING,
+                                db_constraint=False,
+                                related_name='+')
+    status = models.CharField(max_length=10,
+                              choices=Order.StatusChoices.choices)
+    units = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=TOTAL_MAX_DIGITS,
+                                  decimal_places=2,
+                                  default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'status'],
+                                    name='unique_product_sales_day')
+        ]
+
+    def __str__(self):
+        return f"{self.day} product {self.product_id} ({self.status})"
+
+
+class SalesDaily(models.Model):
+    """
+    Same as 'ProductSalesDaily' but for all products together: one row
+    per day and status, for the revenue-over-time chart.
+    """
+    day = models.DateField()
+    status = models.CharField(max_length=10,
+                              choices=Order.StatusChoices.choices)
+    units = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=TOTAL_MAX_DIGITS,
+                                  decimal_places=2,
+                                  default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'],
+                                    name='unique_sales_day')
+        ]
+
+    def __str__(self):
+        return f"{self.day} ({self.status})"
+
+
+class UserOrderSummary(models.Model):
+    """
+    "N orders, M pending, X spent" for one user, kept up to date in the
+    same transaction as every order write (see 'api/rollups.py'), so it
+    can be shown without loading all of the user's orders.
+
+    Archived orders still count. 'manage.py reconcile_order_summaries'
+    checks these numbers against the orders and repairs them.
+    """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='order_summary')
+    # Plain (signed) integers: a count that drifted below zero must not
+    # make order writes fail. The reconcile command fixes it.
+    pending_orders = models.IntegerField(default=0)
+    confirmed_orders = models.IntegerField(default=0)
+    cancelled_orders = models.IntegerField(default=0)
+    # Total of all orders that aren't cancelled.
+    spent = models.DecimalField(max_digits=TOTAL_MAX_DIGITS,
+                                decimal_places=2,
+                                default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    # Order status -> the field counting orders in that status.
+    COUNT_FIELDS = {
+        Order.StatusChoices.PENDING: 'pending_orders',
+        Order.StatusChoices.CONFIRMED: 'confirmed_orders',
+        Order.StatusChoices.CANCELLED: 'cancelled_orders',
+    }
 
     def __str__(self):
-        return f"{self.quantity} * {self.product.name} in order {self.order.order_id}"
+        return f"Order summary of {self.user_id}"
@@ -0,0 +1,30 @@
+"""
+Start-up of the worker processes of 'manage.py run_jobs --pool process'.
+
+The pool is passed this module's function by name and imports it in the
+new process before Django is set up, so nothing here may import models
+(or anything that does) at the top.
+"""
+import django
+from django.db import connections
+
+# Connections a worker found already open, kept so they are never used,
+# closed or garbage collected (which would close them too) in the worker.
+_inherited = []
+
+
+def init_worker():
+    """
+    Sets Django up in a fresh worker process and makes sure it never
+    touches a database connection inherited from the parent.
+
+    With the 'spawn' start method there is nothing to inherit, but under
+    'fork' the child gets the parent's open connections: the very same
+    socket. Closing it in the child (e.g. 'close_old_connections()' in
+    'execute_job') would end the parent's session on PostgreSQL.
+    """
+    django.setup()
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is not None:
+            _inherited.append(conn.connection)
+            conn.connection = None
@@ -0,0 +1,317 @@
+"""
+Numbers kept up to date as orders are written, instead of being
+computed from all orders every time they are shown:
+
+- daily sales ('ProductSalesDaily' and 'SalesDaily');
+- per-user order summaries ('UserOrderSummary').
+
+Every write that changes them adds or subtracts its share here, in the
+same transaction:
+
+- orders and items created/changed/deleted and order status changes go
+  through the signal receivers in 'signals.py';
+- 'bulk_create()' / '.update()' paths (bulk orders, admin actions) call
+  'record_orders()' / 'record_items()' / 'move_orders()' themselves.
+
+Archiving ('changes.paused()') doesn't touch them: an archived order
+was still sold. Deleting a user takes their sales out of the daily
+rollups too (their orders and archived orders are gone, so the backfill
+wouldn't find them either). 'manage.py backfill_sales_rollups' and 'manage.py
+reconcile_order_summaries' recompute them from the order tables.
+"""
+import contextlib
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import (Count, DecimalField, ExpressionWrapper, F,
+                              OuterRef, Subquery,
+                              Max, Sum, Value)
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from api.models import (TOTAL_MAX_DIGITS, ArchivedOrder, ArchivedOrderItem,
+                        Order, OrderItem, ProductSalesDaily, SalesDaily,
+                        UserOrderSummary)
+
+_state = threading.local()
+
+
+def sale_day(created_at):
+    # Same as 'TruncDate' in the backfill: the date in the current
+    # time zone.
+    return timezone.localdate(created_at)
+
+
+class _Changes:
+    """Changes collected by 'batched()', not written yet."""
+
+    def __init__(self):
+        # (day, product id, status) -> [units, revenue]
+        self.sales = defaultdict(lambda: [0, Decimal(0)])
+        # user id -> {'orders': Counter(status -> n), 'spent': Decimal,
+        #             'last_order_at': datetime or None,
+        #             'recount_last': True if an order was deleted}
+        self.users = defaultdict(lambda: {
+            'orders': Counter(),
+            'spent': Decimal(0),
+            'last_order_at': None,
+            'recount_last': False
+        })
+
+
+@contextlib.contextmanager
+def batched():
+    """
+    Collects the changes made inside the block and writes them once at
+    the end (one UPDATE per product/day/status and per user, instead of
+    one per item). Use it inside the transaction that makes the changes.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        yield  # already batching further up
+        return
+    _state.pending = _Changes()
+    try:
+        yield
+        pending = _state.pending
+    finally:
+        _state.pending = None
+    apply(pending)
+
+
+def record_items(items, sign=1, users=True):
+    """
+    'items': (user id, order created_at, order status, product id,
+    quantity, price) tuples. Adds them (sign=1) or takes them away
+    (sign=-1). With 'users=False' the users' summaries are left alone
+    (the users are being deleted).
+    """
+    with batched():
+        pending = _state.pending
+        for user_id, created_at, status, product_id, quantity, price in items:
+            entry = pending.sales[(sale_day(created_at), product_id, status)]
+            entry[0] += sign * quantity
+            entry[1] += sign * quantity * price
+            if users and status != Order.StatusChoices.CANCELLED:
+                pending.users[user_id]['spent'] += sign * quantity * price
+
+
+def record_orders(orders, sign=1):
+    """
+    'orders': (user id, created_at, status) tuples of orders created
+    (sign=1) or deleted (sign=-1). Their items are counted separately.
+    """
+    with batched():
+        pending = _state.pending
+        for user_id, created_at, status in orders:
+            user = pending.users[user_id]
+            user['orders'][status] += sign
+            if sign < 0:
+                # It may have been the newest one.
+                user['recount_last'] = True
+            elif (user['last_order_at'] is None
+                  or created_at > user['last_order_at']):
+                user['last_order_at'] = created_at
+
+
+def move_orders(changed, new_status):
+    """
+    'changed': (order id, user id, old status) of orders whose status
+    was just set to 'new_status'. Moves them and their items from the
+    old status to the new one. One query.
+    """
+    old_statuses = {order_id: old for order_id, _, old in changed}
+    items = OrderItem.objects.filter(order__in=old_statuses).values_list(
+        'order_id', 'order__user_id', 'order__created_at', 'product_id',
+        'quantity', 'unit_price')
+    with batched():
+        for _, user_id, old_status in changed:
+            orders = _state.pending.users[user_id]['orders']
+            orders[old_status] -= 1
+            orders[new_status] += 1
+        for order_id, *item in items:
+            user_id, created_at, product_id, quantity, price = item
+            record_items([(user_id, created_at, old_statuses[order_id],
+                           product_id, quantity, price)],
+                         sign=-1)
+            record_items([(user_id, created_at, new_status, product_id,
+                           quantity, price)])
+
+
+def _upsert(model, key, changes, initial):
+    """
+    Applies 'changes' (expressions) to the row 'key' of 'model', or
+    creates it with the values 'initial' if it doesn't exist yet.
+    """
+    if model.objects.filter(**key).update(**changes):
+        return
+    try:
+        # Savepoint, so a lost race doesn't break the outer transaction.
+        with transaction.atomic():
+            model.objects.create(**key, **initial)
+    except IntegrityError:
+        # Another transaction created the row in the meantime.
+        model.objects.filter(**key).update(**changes)
+
+
+def _add(model, key, **amounts):
+    _upsert(model, key,
+            {name: F(name) + amount
+             for name, amount in amounts.items()}, amounts)
+
+
+def apply(pending):
+    """Writes the changes collected in a '_Changes'."""
+    # Always in the same order, so two transactions touching the same
+    # rows lock them in the same order (no deadlocks).
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for (day, product_id, status), (units, revenue) in sorted(
+            pending.sales.items()):
+        if not units and not revenue:
+            continue
+        _add(ProductSalesDaily, {
+            'day': day,
+            'product_id': product_id,
+            'status': status
+        },
+             units=units,
+             revenue=revenue)
+        totals[(day, status)][0] += units
+        totals[(day, status)][1] += revenue
+    for (day, status), (units, revenue) in sorted(totals.items()):
+        _add(SalesDaily, {'day': day, 'status': status},
+             units=units,
+             revenue=revenue)
+
+    for user_id, user in sorted(pending.users.items()):
+        amounts = {
+            UserOrderSummary.COUNT_FIELDS[status]: n
+            for status, n in user['orders'].items() if n
+        }
+        if user['spent']:
+            amounts['spent'] = user['spent']
+        changes = {name: F(name) + amount for name, amount in amounts.items()}
+        last = user['last_order_at']
+        if last is not None:
+            amounts['last_order_at'] = last
+            changes['last_order_at'] = Greatest(
+                Coalesce('last_order_at', Value(last)), Value(last))
+        if changes:
+            _upsert(UserOrderSummary, {'user_id': user_id}, changes, amounts)
+    recount_last_order_at(
+        [user_id for user_id, user in pending.users.items()
+         if user['recount_last']])
+
+
+def recount_last_order_at(user_ids):
+    """
+    Sets 'last_order_at' of the users' summaries from their orders
+    (archive included), in one query. The counters can only move it
+    forward; this is for when their newest order may be gone.
+    """
+    if not user_ids:
+        return
+    live, archived = (Subquery(
+        model.objects.filter(user_id=OuterRef('user_id')).order_by(
+            '-created_at').values('created_at')[:1])
+                      for model in (Order, ArchivedOrder))
+    # 'GREATEST()' of a NULL is NULL on some databases: no orders in one
+    # of the tables must not hide the other.
+    UserOrderSummary.objects.filter(user_id__in=sorted(user_ids)).update(
+        last_order_at=Greatest(Coalesce(live, archived),
+                               Coalesce(archived, live)))
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _items_total():
+    # SUM(quantity * unit_price) of order items (live or archived).
+    return Sum(
+        ExpressionWrapper(F('quantity') * F('unit_price'),
+                          output_field=DecimalField(
+                              max_digits=TOTAL_MAX_DIGITS,
+                              decimal_places=2)))
+
+
+def rebuild_days(first_day, last_day):
+    """
+    Recomputes the rollups of 'first_day'..'last_day' (inclusive) from
+    the order tables, archive included, in one transaction. Returns the
+    number of product rows written.
+    """
+    start, end = _day_start(first_day), _day_start(last_day +
+                                                   timedelta(days=1))
+    rows = defaultdict(lambda: [0, Decimal(0)])
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    # Read and write in one transaction, so orders written meanwhile are
+    # either in what we read or added on top of what we write.
+    with transaction.atomic():
+        for model in (OrderItem, ArchivedOrderItem):
+            sold = model.objects.filter(
+                order__created_at__gte=start,
+                order__created_at__lt=end).values_list(
+                    TruncDate('order__created_at'), 'product_id',
+                    'order__status').annotate(
+                        units=Sum('quantity'),
+                        money=_items_total()).order_by()
+            for day, product_id, status, units, money in sold:
+                rows[(day, product_id, status)][0] += units
+                rows[(day, product_id, status)][1] += money
+                totals[(day, status)][0] += units
+                totals[(day, status)][1] += money
+
+        for model in (ProductSalesDaily, SalesDaily):
+            model.objects.filter(day__gte=first_day,
+                                 day__lte=last_day).delete()
+        ProductSalesDaily.objects.bulk_create([
+            ProductSalesDaily(day=day,
+                              product_id=product_id,
+                              status=status,
+                              units=units,
+                              revenue=money)
+            for (day, product_id, status), (units, money) in rows.items()
+        ])
+        SalesDaily.objects.bulk_create([
+            SalesDaily(day=day, status=status, units=units, revenue=money)
+            for (day, status), (units, money) in totals.items()
+        ])
+    return len(rows)
+
+
+def actual_order_summaries(user_ids):
+    """
+    Computes {user id: {field: value}} for 'UserOrderSummary' from the
+    order tables (archive included) for the given users. Users without
+    any order are left out. Spend uses the prices the items were
+    ordered at.
+    """
+    summaries = defaultdict(lambda: {
+        'pending_orders': 0,
+        'confirmed_orders': 0,
+        'cancelled_orders': 0,
+        'spent': Decimal('0.00'),
+        'last_order_at': None,
+    })
+    for order_model, item_model in ((Order, OrderItem), (ArchivedOrder,
+                                                         ArchivedOrderItem)):
+        orders = order_model.objects.filter(user_id__in=user_ids)
+        for user_id, status, count, last in orders.values_list(
+                'user_id', 'status').annotate(Count('pk'),
+                                              Max('created_at')).order_by():
+            summary = summaries[user_id]
+            summary[UserOrderSummary.COUNT_FIELDS[status]] += count
+            if summary['last_order_at'] is None or last > summary[
+                    'last_order_at']:
+                summary['last_order_at'] = last
+        spent = item_model.objects.filter(
+            order__user_id__in=user_ids).exclude(
+                order__status=Order.StatusChoices.CANCELLED).values_list(
+                    'order__user_id').annotate(
+                        money=_items_total()).order_by()
+        for user_id, amount in spent:
+            summaries[user_id]['spent'] += amount
+    return dict(summaries)
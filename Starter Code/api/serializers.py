@@ -1,19 +1,69 @@
+from datetime import timedelta
+
 from rest_framework import serializers
 from .models import *
+from . import rollups
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
 from django.db import transaction
 # --- SERIALIZERS ---
 
 # (This UserSerializer is commented out, but it's how you *would* serialize a user)
 
 
+class UserOrderSummarySerializer(serializers.ModelSerializer):
+    """
+    "N orders, M pending, X spent" for one user ('GET /orders/summary/').
+    """
+    total_orders = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UserOrderSummary
+        fields = ('total_orders', 'pending_orders', 'confirmed_orders',
+                  'cancelled_orders', 'spent', 'last_order_at')
+
+    def get_total_orders(self, obj):
+        return obj.pending_orders + obj.confirmed_orders + obj.cancelled_orders
+
+
 class UserSerializer(serializers.ModelSerializer):
 
+    # Optional: only sent with '?include=order_summary', and only for the
+    # requesting user (staff see everyone's). The view joins the summary
+    # table in that case, so it costs no extra query per user.
+    order_summary = serializers.SerializerMethodField()
+
+    OPTIONAL_FIELDS = ('order_summary', )
+
     class Meta:
         model = User
-        fields = ('username', 'email', 'is_staff', 'orders')
+        fields = ('username', 'email', 'is_staff', 'orders', 'order_summary')
         #exclude = ('password','user_permission')
         # fields = ('__all__')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self.OPTIONAL_FIELDS:
+            if name not in self.included_fields(self.context.get('request')):
+                self.fields.pop(name)
+
+    @staticmethod
+    def included_fields(request):
+        if request is None:
+            return set()
+        return set(request.query_params.get('include', '').split(','))
+
+    def get_order_summary(self, obj):
+        viewer = self.context['request'].user
+        if not (viewer.is_staff or viewer.pk == obj.pk):
+            return None
+        try:
+            summary = obj.order_summary
+        except UserOrderSummary.DoesNotExist:
+            summary = UserOrderSummary(user=obj)  # no orders yet: zeros
+        return UserOrderSummarySerializer(summary).data
+
 
 class ProductSerializer(serializers.ModelSerializer):
     """
@@ -22,12 +72,27 @@ class ProductSerializer(serializers.ModelSerializer):
     generate fields for you based on your model.
     """
 
+    # {"200": "<url>", "600": "<url>", ...}: smaller WebP copies of
+    # 'image'. Empty for a moment after an upload, while they are made
+    # in the background (see api/images.py).
+    image_renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = Product  # 1. Link to the Product model
 
-        fields = ('description', 'name', 'price', 'stock'
+        fields = ('description', 'name', 'price', 'stock', 'image',
+                  'image_renditions'
                   )  # 2. List the fields you want to include in the JSON.
 
+    def get_image_renditions(self, obj):
+        # Absolute URLs, like DRF gives for 'image' when it has a request.
+        request = self.context.get('request')
+        urls = {}
+        for width, name in obj.image_renditions.items():
+            url = default_storage.url(name)
+            urls[width] = request.build_absolute_uri(url) if request else url
+        return urls
+
     def validate_price(self, value):
         """
         This is a custom validation method.
@@ -52,7 +117,8 @@ class OrderItemSerializer(serializers.ModelSerializer):
     # and grab data from the related Product object.
     # This makes the API response much cleaner for the frontend.
     product_name = serializers.CharField(source='product.name')
-    product_price = serializers.DecimalField(source='product.price',
+    # The price the product had when it was ordered (a copy on the item).
+    product_price = serializers.DecimalField(source='unit_price',
                                              max_digits=10,
                                              decimal_places=2)
 
@@ -71,19 +137,28 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         class Meta:
             model = OrderItem
             fields = ('product', 'quantity')
+            # Bounded like the column: a bigger number would only fail
+            # in the database.
+            extra_kwargs = {'quantity': {'max_value': OrderItem.MAX_QUANTITY}}
 
     order_id = serializers.UUIDField(read_only=True)
     items = OrderItemCreateSerializer(many=True, required=False)
 
     def update(self, instance, validated_data):
+        # Not at the top: api.signals imports (through api.changes) this
+        # module.
+        from .signals import delete_order_items
+
         orderitem_data = validated_data.pop('items')
 
-        with transaction.atomic():
+        # 'batched()': the sales rollups get one write per product at the
+        # end instead of one per item (see api/rollups.py).
+        with transaction.atomic(), rollups.batched():
             instance = super().update(instance, validated_data)
 
             if orderitem_data is not None:
                 #clear exiting items(optional, depends on requarment)
-                instance.items.all().delete()
+                delete_order_items(instance)
                 #recreate it with the updateded data
                 for item in orderitem_data:
                     OrderItem.objects.create(order=instance, **item)
@@ -92,7 +167,7 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         orderitem_data = validated_data.pop('items')
 
-        with transaction.atomic():
+        with transaction.atomic(), rollups.batched():
 
             order = Order.objects.create(**validated_data)
 
@@ -107,6 +182,28 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         extra_kwargs = {'user': {'read_only': True}}
 
 
+class OrderBulkCreateSerializer(serializers.Serializer):
+    """
+    Validates *one* order of a bulk request ('POST /orders/bulk/').
+
+    Unlike 'OrderCreateSerializer', 'product' is a plain integer here.
+    A 'PrimaryKeyRelatedField' would run one query per item to check the
+    product exists; with thousands of orders that's far too slow, so the
+    view checks all product ids at once with a single query instead.
+    """
+
+    class ItemSerializer(serializers.Serializer):
+        # Bounded like the columns: a bigger number would only fail in
+        # the database, and take the whole chunk of orders with it.
+        product = serializers.IntegerField(min_value=1, max_value=2**63 - 1)
+        quantity = serializers.IntegerField(min_value=0,
+                                            max_value=OrderItem.MAX_QUANTITY)
+
+    status = serializers.ChoiceField(choices=Order.StatusChoices.choices,
+                                     default=Order.StatusChoices.PENDING)
+    items = ItemSerializer(many=True, default=list)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     """
     Serializes the Order model. This is a "nested" serializer.
@@ -152,6 +249,35 @@ class OrderSerializer(serializers.ModelSerializer):
                   'total_price')
 
 
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+    # Copied into the archive, so no need for the product itself.
+    product_name = serializers.CharField()
+
+    class Meta(OrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+
+class ArchivedOrderSerializer(OrderSerializer):
+    """
+    Same JSON shape as 'OrderSerializer', so clients can't tell (and don't
+    need to care) whether an order came from the archive.
+    """
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
+
+class OrderItemChangeSerializer(serializers.ModelSerializer):
+    """
+    Flat version of an OrderItem (just ids), used by the change feed.
+    """
+
+    class Meta:
+        model = OrderItem
+        fields = ('id', 'order', 'product', 'quantity')
+
+
 class ProductInfoSerializer(serializers.Serializer):
     """
     This is a "manual" serializer, not a ModelSerializer.
@@ -164,3 +290,45 @@ class ProductInfoSerializer(serializers.Serializer):
     count = serializers.IntegerField()
     # We expect a simple float field.
     max_price = serializers.FloatField()
+
+
+class SalesAnalyticsQuerySerializer(serializers.Serializer):
+    """
+    Validates the query string of 'GET /analytics/sales/'.
+    'status' is a comma-separated list, e.g. '?status=Pending,Confirmed'.
+    """
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    status = serializers.CharField(required=False)
+    top = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    order_by = serializers.ChoiceField(choices=['revenue', 'units'],
+                                       default='revenue')
+
+    def validate_status(self, value):
+        statuses = [s.strip() for s in value.split(',') if s.strip()]
+        unknown = set(statuses) - set(Order.StatusChoices.values)
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown status: {', '.join(sorted(unknown))}.")
+        return statuses
+
+    def validate(self, data):
+        # Default: the last ANALYTICS_DEFAULT_DAYS days, and cancelled
+        # orders don't count as sales.
+        data.setdefault('end', timezone.localdate())
+        data.setdefault(
+            'start',
+            data['end'] - timedelta(days=settings.ANALYTICS_DEFAULT_DAYS - 1))
+        data.setdefault('status', [
+            Order.StatusChoices.PENDING, Order.StatusChoices.CONFIRMED
+        ])
+        days = (data['end'] - data['start']).days + 1
+        if days < 1:
+            raise serializers.ValidationError(
+                {'start': 'Must not be after end.'})
+        if days > settings.ANALYTICS_MAX_DAYS:
+            raise serializers.ValidationError({
+                'start':
+                f'At most {settings.ANALYTICS_MAX_DAYS} days at a time.'
+            })
+        return data
@@ -0,0 +1,215 @@
+import weakref
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from api import rollups
+from api.changes import TRACKED_MODELS, is_paused, record_changes
+from api.events import publish_order_status
+from api.facets import invalidate_product_facets
+from api.images import delete_renditions, schedule_renditions
+from api.jobs import enqueue
+from api.models import (ArchivedOrder, ArchivedOrderItem, ChangeEvent, Order,
+                        OrderItem, Product, User)
+
+
+@receiver(post_init, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # Keep the status the order had when it was loaded, so after a save
+    # we can tell whether it actually changed (without another query).
+    # We read '__dict__' so a deferred 'status' ('.only(...)') doesn't
+    # trigger a query for every loaded order.
+    instance._loaded_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Order)
+def announce_order_status_change(sender, instance, created, **kwargs):
+    old_status = instance._loaded_status
+    instance._loaded_status = instance.status
+    if created or old_status is None or old_status == instance.status:
+        return
+    publish_order_status(instance.order_id, instance.user_id, old_status,
+                         instance.status)
+    if not is_paused():
+        # The order and its items now count for the new status.
+        rollups.move_orders([(instance.pk, instance.user_id, old_status)],
+                            instance.status)
+
+
+@receiver(post_save, sender=Order)
+def count_new_order(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not is_paused():
+        rollups.record_orders([(instance.user_id, instance.created_at,
+                                instance.status)])
+
+
+def deleted_with_user(origin):
+    # Deleting a user also deletes their orders (archived ones too) and
+    # order summary; we must not write a new summary row for a user
+    # that's going away. Their sales do leave the daily rollups, as
+    # the backfill can't find them any more either.
+    return isinstance(origin, User) or getattr(origin, 'model', None) is User
+
+
+# Orders being deleted right now, by pk. Their items are deleted (and
+# uncounted) first, and when the items come from a cascade they don't
+# have the order loaded: this saves a query per item. Weak, so entries
+# go away with the delete (even a failed one).
+_deleting_orders = weakref.WeakValueDictionary()
+
+
+@receiver(pre_delete, sender=Order)
+@receiver(pre_delete, sender=ArchivedOrder)
+def remember_deleted_order(sender, instance, **kwargs):
+    _deleting_orders[instance.pk] = instance
+
+
+def delete_order_items(order):
+    """
+    Deletes all of 'order''s items (e.g. to replace them). Like a cascade,
+    the items are uncounted with the order we already have.
+    """
+    _deleting_orders[order.pk] = order
+    try:
+        order.items.all().delete()
+    finally:
+        _deleting_orders.pop(order.pk, None)
+
+
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=ArchivedOrder)
+def uncount_deleted_order(sender, instance, origin=None, **kwargs):
+    # Its items were deleted (and uncounted) just before.
+    if not is_paused() and not deleted_with_user(origin):
+        rollups.record_orders([(instance.user_id, instance.created_at,
+                                instance.status)],
+                              sign=-1)
+
+
+@receiver(post_init, sender=OrderItem)
+def remember_order_item_sale(sender, instance, **kwargs):
+    # What a loaded item counts for in the rollups, to undo it if
+    # the item is changed. 'None' for new items.
+    if instance.__dict__.get('id') is None:
+        instance._loaded_sale = None
+    else:
+        instance._loaded_sale = (instance.__dict__.get('product_id'),
+                                 instance.__dict__.get('quantity'),
+                                 instance.__dict__.get('unit_price'))
+
+
+@receiver(pre_save, sender=OrderItem)
+def copy_product_price(sender, instance, raw=False, **kwargs):
+    # A new item (or one switched to another product) gets the product's
+    # current price; after that, price changes don't touch it.
+    if raw:
+        return
+    loaded = instance._loaded_sale
+    if instance.unit_price is None or (loaded is not None
+                                       and loaded[0] != instance.product_id):
+        instance.unit_price = instance.product.price
+
+
+@receiver(post_save, sender=OrderItem)
+def count_order_item_sale(sender, instance, created, raw=False, **kwargs):
+    old_sale = instance._loaded_sale
+    instance._loaded_sale = (instance.product_id, instance.quantity,
+                             instance.unit_price)
+    if raw or is_paused() or old_sale == instance._loaded_sale:
+        return
+    # Items are saved with their order at hand ('order.items.create()',
+    # 'OrderItem(order=...)'), so this is normally no query.
+    order = instance.order
+    with rollups.batched():
+        if old_sale is not None:
+            # Taken away at the price it was added with.
+            rollups.record_items([(order.user_id, order.created_at,
+                                   order.status, *old_sale)],
+                                 sign=-1)
+        rollups.record_items([(order.user_id, order.created_at,
+                               order.status, *instance._loaded_sale)])
+
+
+@receiver(post_delete, sender=OrderItem)
+@receiver(post_delete, sender=ArchivedOrderItem)
+def uncount_order_item_sale(sender, instance, origin=None, **kwargs):
+    if is_paused():
+        return
+    order = _deleting_orders.get(instance.order_id) or instance.order
+    rollups.record_items([(order.user_id, order.created_at, order.status,
+                           instance.product_id, instance.quantity,
+                           instance.unit_price)],
+                         sign=-1,
+                         users=not deleted_with_user(origin))
+
+
+def record_save(sender, instance, created, raw=False, **kwargs):
+    # 'raw' is True while loading fixtures; those aren't real changes.
+    if raw or is_paused():
+        return
+    if created:
+        action = ChangeEvent.Actions.CREATE
+    else:
+        action = ChangeEvent.Actions.UPDATE
+    record_changes(sender, [instance.pk], action)
+
+
+def record_delete(sender, instance, **kwargs):
+    if is_paused():
+        return
+    record_changes(sender, [instance.pk], ChangeEvent.Actions.DELETE)
+
+
+# Feed every tracked model into the change feed.
+for model in TRACKED_MODELS:
+    post_save.connect(record_save,
+                      sender=model,
+                      dispatch_uid=f'change_feed_save_{model.__name__}')
+    post_delete.connect(record_delete,
+                        sender=model,
+                        dispatch_uid=f'change_feed_delete_{model.__name__}')
+
+
+@receiver(post_init, sender=Product)
+def remember_product_image(sender, instance, **kwargs):
+    # Same trick as for the order status: remember the image name we
+    # loaded, to spot a new upload after 'save()'.
+    image = instance.__dict__.get('image')
+    instance._loaded_image = getattr(image, 'name', image)
+
+
+@receiver(post_save, sender=Product)
+def process_new_product_image(sender, instance, created, raw=False, **kwargs):
+    old_image = instance._loaded_image
+    new_image = instance.image.name if instance.image else None
+    instance._loaded_image = new_image
+    if raw or old_image == new_image:
+        return
+    if new_image:
+        schedule_renditions(instance)
+    elif instance.image_renditions:
+        # Image removed: the renditions don't belong to anything now.
+        names = list(instance.image_renditions.values())
+        Product.objects.filter(pk=instance.pk).update(image_renditions={})
+        instance.image_renditions = {}
+        enqueue(delete_renditions, args=[names])
+
+
+@receiver(post_delete, sender=Product)
+def delete_product_files(sender, instance, **kwargs):
+    names = list(instance.image_renditions.values())
+    if instance.image:
+        names.append(instance.image.name)
+    if names:
+        # A job, so the files only go once the delete has committed.
+        enqueue(delete_renditions, args=[names])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_facets(sender, **kwargs):
+    # After commit: invalidating earlier would let a request cache the
+    # old counts again before the change is visible.
+    transaction.on_commit(invalidate_product_facets)
@@ -0,0 +1,348 @@
+"""
+Test helpers for tests that need more than a handful of rows.
+
+- 'make_users()', 'make_products()' and 'make_orders()' write with
+  'bulk_create' (one INSERT per few hundred rows instead of one per
+  row) and bring the rollups up to date.
+
+- 'SeededTestCase' loads a dataset of a given scale ('DATASETS') once
+  per test class, in 'setUpTestData'. Every test runs in a transaction
+  that is rolled back, so they all start from the same data.
+
+- On SQLite a dataset is only generated once: it's saved to a snapshot
+  file ('.cache/test-snapshots/' in the project, git ignores it), and
+  from then on test classes (later runs and the '--parallel' workers
+  too) copy the rows from there with one 'INSERT ... SELECT' per table.
+  The file name has a hash of the schema and the date, so a migration
+  (or a new day, the orders' dates are relative) means a new file; the
+  old one is deleted. On other databases the dataset is
+  generated for every class.
+
+- 'TestRunner' (settings.TEST_RUNNER) swaps in a fast password hasher.
+
+Run the tests on all CPUs with 'python manage.py test --parallel auto'
+(install 'tblib' to see the tracebacks of failures in the workers).
+"""
+import glob
+import hashlib
+import os
+import random
+import sqlite3
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.runner import DiscoverRunner
+from django.utils import timezone
+
+from api import rollups
+from api.models import Order, OrderItem, Product, User, UserOrderSummary
+
+# Sizes of the seeded datasets. Orders have 1 to 4 items each.
+DATASETS = {
+    'small': {
+        'users': 10,
+        'products': 50,
+        'orders': 200
+    },
+    'medium': {
+        'users': 100,
+        'products': 500,
+        'orders': 5000
+    },
+    'large': {
+        'users': 1000,
+        'products': 2000,
+        'orders': 50000
+    },
+}
+# Change it when the factories change, so old snapshots aren't reused.
+DATASET_VERSION = 1
+SNAPSHOT_DIR = os.path.join(settings.BASE_DIR, '.cache', 'test-snapshots')
+BATCH_SIZE = 500
+
+# --- FACTORIES ---
+
+
+def make_users(count, prefix='user', start=1, password='test', **fields):
+    """
+    'count' users named '<prefix>1', '<prefix>2'... all with the same
+    password. Extra 'fields' are set on every user.
+    """
+    # Hashing is slow on purpose, so do it once for all of them.
+    hashed = make_password(password)
+    return User.objects.bulk_create([
+        User(username=f'{prefix}{n}', password=hashed, **fields)
+        for n in range(start, start + count)
+    ],
+                                    batch_size=BATCH_SIZE)
+
+
+def make_products(count, rng=None, prefix='Product', **fields):
+    """
+    'count' products with random prices (0.50 to 500.00) and stock (0
+    to 99). Extra 'fields' are set on every product.
+    """
+    rng = rng or random.Random()
+    products = []
+    for n in range(count):
+        values = {
+            'name': f'{prefix} {n}',
+            'description': '',
+            'price': Decimal(rng.randrange(50, 50001)) / 100,
+            'stock': rng.randrange(100),
+        }
+        values.update(fields)
+        products.append(Product(**values))
+    return Product.objects.bulk_create(products, batch_size=BATCH_SIZE)
+
+
+def make_orders(users, products, count, rng=None, items=(1, 4), days=30,
+                statuses=None):
+    """
+    'count' orders of random 'users' and 'statuses', with 'items' (min,
+    max) random 'products' each, spread over the last 'days' days.
+
+    The rollups and order summaries are brought up to date. The change
+    feed isn't: like history imported before it existed.
+    """
+    rng = rng or random.Random()
+    statuses = statuses or Order.StatusChoices.values
+    low, high = (min(n, len(products)) for n in items)
+    orders, order_items = [], []
+    for _ in range(count):
+        # Random, but the same for the same 'rng' seed.
+        order = Order(order_id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                      user=rng.choice(users),
+                      status=rng.choice(statuses))
+        orders.append(order)
+        order_items += [
+            OrderItem(order=order,
+                      product=product,
+                      quantity=rng.randint(1, 5),
+                      unit_price=product.price)
+            for product in rng.sample(products, rng.randint(low, high))
+        ]
+
+    now = timezone.now()
+    by_age = defaultdict(list)
+    for order in orders:
+        by_age[rng.randrange(days)].append(order)
+
+    with transaction.atomic():
+        Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+        OrderItem.objects.bulk_create(order_items, batch_size=BATCH_SIZE)
+        # 'created_at' is 'auto_now_add' (bulk_create sets it to now), so
+        # the dates are spread afterwards: a few UPDATEs per day.
+        for age, day_orders in sorted(by_age.items()):
+            created_at = now - timedelta(days=age)
+            for start in range(0, len(day_orders), BATCH_SIZE):
+                chunk = day_orders[start:start + BATCH_SIZE]
+                Order.objects.filter(pk__in=[o.pk for o in chunk]).update(
+                    created_at=created_at)
+                for order in chunk:
+                    order.created_at = created_at
+        # Then the rollups are recomputed from the tables, like
+        # 'backfill_sales_rollups' and 'reconcile_order_summaries' do: a
+        # few queries, instead of an UPDATE per product/day/status.
+        rollups.rebuild_days(rollups.sale_day(now - timedelta(days=days)),
+                             rollups.sale_day(now))
+        user_ids = {order.user_id for order in orders}
+        UserOrderSummary.objects.filter(user_id__in=user_ids).delete()
+        UserOrderSummary.objects.bulk_create([
+            UserOrderSummary(user_id=user_id, **summary) for user_id, summary
+            in rollups.actual_order_summaries(user_ids).items()
+        ])
+    return orders
+
+
+# --- SEEDED DATASETS ---
+
+
+def seed_dataset(scale, seed=0):
+    """Writes the dataset 'scale' (a key of 'DATASETS')."""
+    size = DATASETS[scale]
+    rng = random.Random(seed)
+    users = make_users(size['users'], prefix='seed-user')
+    products = make_products(size['products'], rng, prefix='Seed product')
+    make_orders(users, products, size['orders'], rng)
+
+
+def _tables(cursor, schema='main'):
+    cursor.execute(f"SELECT name, sql FROM {schema}.sqlite_master "
+                   "WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                   "ORDER BY name")
+    return cursor.fetchall()
+
+
+def snapshot_path(scale):
+    """
+    The snapshot file of 'scale' for the current schema and day: after a
+    migration (or a 'DATASET_VERSION' change) it's a new file.
+
+    The orders are dated relative to when they were generated ("3 days
+    ago"), so yesterday's snapshot would have them all a day older than
+    the tests expect: each day gets its own file too.
+    """
+    with connection.cursor() as cursor:
+        schema = _tables(cursor)
+    key = hashlib.sha256(
+        repr((DATASETS[scale], DATASET_VERSION, schema,
+              timezone.localdate())).encode()).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, f'{scale}-{key}.sqlite3')
+
+
+def build_snapshot(scale, path):
+    """
+    Generates the dataset in the test database, copies the rows it
+    added into a new SQLite file at 'path' and rolls back. Snapshots of
+    the same scale for other schemas are deleted.
+    """
+    make_snapshot_dir(os.path.dirname(path))
+    partial = f'{path}.{os.getpid()}.tmp'
+    target = sqlite3.connect(partial)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Tables filled by the migrations (content types...) already
+            # have their rows in every test database.
+            empty = set()
+            for name, _ in _tables(cursor):
+                cursor.execute(f'SELECT 1 FROM "{name}" LIMIT 1')
+                if cursor.fetchone() is None:
+                    empty.add(name)
+
+            seed_dataset(scale)
+            for name, sql in _tables(cursor):
+                if name not in empty:
+                    continue
+                cursor.execute(f'PRAGMA table_info("{name}")')
+                columns = [row[1] for row in cursor.fetchall()]
+                # '+column' is the same value without the column's type,
+                # so Django doesn't convert it (dates stay text...).
+                cursor.execute('SELECT {} FROM "{}"'.format(
+                    ', '.join(f'+"{c}"' for c in columns), name))
+                rows = cursor.fetchall()
+                if rows:
+                    target.execute(sql)
+                    target.executemany(
+                        'INSERT INTO "{}" VALUES ({})'.format(
+                            name, ', '.join('?' * len(columns))), rows)
+            transaction.set_rollback(True)
+        target.commit()
+    finally:
+        target.close()
+    # Only complete files get the real name, so '--parallel' workers
+    # building the same snapshot don't read each other's half-written
+    # ones (the last to finish wins, they are identical).
+    os.replace(partial, path)
+    prune_snapshots(path)
+
+
+def make_snapshot_dir(directory):
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        # Like '.pytest_cache': the directory tells git to ignore it.
+        with open(os.path.join(directory, '.gitignore'), 'w') as f:
+            f.write('*\n')
+
+
+def prune_snapshots(path):
+    """
+    Deletes the other snapshots of the scale of 'path' (made for an
+    older schema or 'DATASET_VERSION'), and leftovers of builds that
+    crashed more than an hour ago.
+    """
+    directory = os.path.dirname(path)
+    scale = os.path.basename(path).split('-')[0]
+    stale = set(glob.glob(os.path.join(directory, f'{scale}-*.sqlite3')))
+    stale.discard(path)
+    for partial in glob.glob(os.path.join(directory, '*.tmp')):
+        if os.path.getmtime(partial) < time.time() - 3600:
+            stale.add(partial)
+    for name in stale:
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass  # another '--parallel' worker was faster
+
+
+class SeededTestCase(TestCase):
+    """
+    A 'TestCase' whose tests start with the dataset 'dataset' (a key of
+    'DATASETS'): 'cls.users' and 'cls.products', plus their orders.
+    Subclasses overriding 'setUpTestData' must call 'super()'.
+    """
+    dataset = 'small'
+    snapshot_alias = 'snapshot'
+
+    @classmethod
+    def setUpClass(cls):
+        # SQLite can't ATTACH inside a transaction, and 'super()' opens
+        # the one around the whole class, so this comes first.
+        cls.snapshot_attached = False
+        if connection.vendor == 'sqlite':
+            path = snapshot_path(cls.dataset)
+            if not os.path.exists(path):
+                build_snapshot(cls.dataset, path)
+            with connection.cursor() as cursor:
+                cursor.execute(f'ATTACH DATABASE %s AS {cls.snapshot_alias}',
+                               [path])
+            cls.snapshot_attached = True
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.detach_snapshot()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.detach_snapshot()
+
+    @classmethod
+    def detach_snapshot(cls):
+        if cls.snapshot_attached:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DETACH DATABASE {cls.snapshot_alias}')
+            cls.snapshot_attached = False
+
+    @classmethod
+    def setUpTestData(cls):
+        if cls.snapshot_attached:
+            with connection.cursor() as cursor:
+                for name, _ in _tables(cursor, cls.snapshot_alias):
+                    cursor.execute(f'INSERT INTO main."{name}" SELECT * '
+                                   f'FROM {cls.snapshot_alias}."{name}"')
+        else:
+            seed_dataset(cls.dataset)
+        cls.users = list(
+            User.objects.filter(username__startswith='seed-user').order_by(
+                'pk'))
+        cls.products = list(Product.objects.order_by('pk'))
+
+
+# --- TEST RUNNER ---
+
+
+class TestRunner(DiscoverRunner):
+    """
+    The default runner, with a fast password hasher: the real one is
+    slow on purpose (a good part of a second per 'create_user()').
+    """
+    fast_hashers = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.fast_hashing = override_settings(
+            PASSWORD_HASHERS=self.fast_hashers)
+        self.fast_hashing.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.fast_hashing.disable()
+        super().teardown_test_environment(**kwargs)
@@ -2,10 +2,12 @@
 
 # TestCase is the most important import. It lets you create a temporary,
 # blank database for every test, so your real data is never touched.
-from django.test import TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase
 
 # Import the models you need to create "fake" data for your tests.
-from api.models import Order, User
+from api.models import (ArchivedOrder, ChangeEvent, IdempotencyKey, Job,
+                        Order, OrderItem, Product, ProductSalesDaily,
+                        SalesDaily, User, UserOrderSummary)
 
 # Import status codes (like 403 FORBIDDEN) to make your tests more readable
 # than just using numbers.
@@ -15,6 +17,53 @@ from rest_framework import status
 # This is much safer than hard-coding the URL like '/api/my-orders/'.
 from django.urls import reverse
 
+# Extra imports for the performance-related tests further down.
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.db.models import Sum
+from django.http import JsonResponse, StreamingHttpResponse
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from rest_framework.test import APIRequestFactory
+
+from asgiref.sync import async_to_sync
+
+from api.admin import (EstimatedCountPaginator, estimate_row_count,
+                       update_order_status)
+from api.archive import archive_orders
+from api.changes import number_events
+from api.events import InProcessBroker, RedisSubscription, get_broker
+from api.jobs import (claim_jobs, enqueue, queue_stats, requeue_stale,
+                      run_job)
+from api.middleware import CompressionMiddleware
+from api.processes import _inherited, init_worker
+from api.rollups import actual_order_summaries
+from api.testing import (SeededTestCase, make_orders, make_users,
+                         prune_snapshots, snapshot_path)
+from api.throttling import (CacheBuckets, LocalBuckets, get_limiter,
+                            local_buckets)
+from api.views import (ProductListCreateAPIView, UserListView,
+                       order_event_stream)
+
 # Create your tests here.
 
 # --- 2. THE TEST SUITE ---
@@ -26,18 +75,20 @@ class UserOrderTestCase(TestCase):
 
     # --- 3. THE "SETUP" METHOD ---
 
-    # 'setUp' is a special method that runs *before* every single test
-    # in this class. Its job is to "Arrange" the test data.
-    def setUp(self):
-        # Create two unique users.
-        user1 = User.objects.create_user(username='user1', password='test')
-        user2 = User.objects.create_user(username='user2', password='test')
+    # 'setUpTestData' is a special method that runs *once* for the whole
+    # class. Its job is to "Arrange" the test data. Every test runs in a
+    # transaction that is rolled back afterwards, so each one still sees
+    # exactly this data (and it isn't created again for every test, like
+    # it would be in 'setUp').
+    @classmethod
+    def setUpTestData(cls):
+        # Create two unique users: 'user1' and 'user2'. The factories in
+        # api/testing.py write many rows in one query ('bulk_create').
+        user1, user2 = make_users(2)
 
         # Create 4 total orders in our temporary database.
-        Order.objects.create(user=user1)  # 2 orders belong to user1
-        Order.objects.create(user=user1)
-        Order.objects.create(user=user2)  # 2 orders belong to user2
-        Order.objects.create(user=user2)
+        make_orders([user1], [], 2)  # 2 orders belong to user1
+        make_orders([user2], [], 2)  # 2 orders belong to user2
 
     # --- 4. TEST 1: THE "HAPPY PATH" (AUTHENTICATED) ---
 
@@ -56,9 +107,10 @@ class UserOrderTestCase(TestCase):
         self.client.force_login(user)
 
         # --- Act (Make the API request) ---
-        # We make a GET request to the URL named 'user-orders'.
+        # We make a GET request to the URL named 'order-list' (the router
+        # names it after the 'orders' viewset: '/orders/').
         # 'self.client' is now acting as an authenticated 'user1'.
-        response = self.client.get(reverse('user-orders'))
+        response = self.client.get(reverse('order-list'))
 
         # --- Assert (Check the results) ---
         # First, check if the page loaded successfully (HTTP 200).
@@ -85,10 +137,1405 @@ class UserOrderTestCase(TestCase):
         # --- Act (Make the API request) ---
         # We make the same GET request, but this time we *do not* log in.
         # 'self.client' is acting as an anonymous "guest".
-        response = self.client.get(reverse('user-orders'))
+        response = self.client.get(reverse('order-list'))
 
         # --- Assert (Check the results) ---
         # We *expect* to be denied.
         # We check that the server returned a "Forbidden" (403) status code,
         # proving our API security (e.g., IsAuthenticated) is working.
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+# --- 6. COMPRESSION MIDDLEWARE ---
+
+
+class CompressionMiddlewareTestCase(SimpleTestCase):
+    """
+    These tests don't need the database, so we use 'SimpleTestCase'
+    and call the middleware directly with a fake request.
+    """
+
+    def get_response(self, accept_encoding, body):
+        request = RequestFactory().get('/',
+                                       HTTP_ACCEPT_ENCODING=accept_encoding)
+        middleware = CompressionMiddleware(
+            lambda request: JsonResponse(body, safe=False))
+        return middleware(request)
+
+    def test_gzip_is_used_when_it_is_the_only_accepted_encoding(self):
+        body = [{'name': 'Coffee Machine', 'price': '70.99'}] * 50
+        response = self.get_response('gzip', body)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), body)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.get_response('gzip', {'ok': True})
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_q_zero_refuses_an_encoding(self):
+        body = [{'name': 'Coffee Machine'}] * 50
+        response = self.get_response('gzip;q=0, identity', body)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_responses_stay_streaming(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(
+            (b'{"chunk": %d}\n' % i for i in range(100)),
+            content_type='application/json'))
+        response = middleware(request)
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(body.count(b'\n'), 100)
+
+    def test_event_streams_are_not_compressed(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(
+            (b'data: %d\n\n' % i for i in range(100)),
+            content_type='text/event-stream'))
+        response = middleware(request)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+# --- 7. BATCH "MULTI-GET" ---
+
+
+class BatchRetrieveTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='user1', password='test')
+        cls.user2 = User.objects.create_user(username='user2', password='test')
+        cls.order1 = Order.objects.create(user=cls.user1)
+        cls.order2 = Order.objects.create(user=cls.user2)
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}',
+                    description='',
+                    price=Decimal('10.00'),
+                    stock=i) for i in range(3)
+        ])
+
+    def test_products_come_back_in_request_order_with_missing_marked(self):
+        p0, p1, p2 = self.products
+        response = self.client.get(f'/product/?ids={p2.pk},999,{p0.pk}')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(
+            [r and r['name'] for r in data['results']],
+            ['Product 2', None, 'Product 0'])
+        self.assertEqual(data['missing'], [999])
+
+    def test_orders_of_other_users_are_reported_as_missing(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(
+            f'/orders/?ids={self.order1.pk},{self.order2.pk}')
+
+        data = response.json()
+        self.assertEqual(data['results'][0]['order_id'],
+                         str(self.order1.pk))
+        self.assertIsNone(data['results'][1])
+        self.assertEqual(data['missing'], [str(self.order2.pk)])
+
+    def test_batch_size_is_capped(self):
+        ids = ','.join(str(i) for i in range(1, 200))
+        response = self.client.get(f'/product/?ids={ids}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ids_out_of_the_column_range_are_invalid(self):
+        for ids in ('abc', '99999999999999999999', '1,-99999999999999999999'):
+            response = self.client.get('/product/', {'ids': ids})
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json(), {'ids': 'Invalid id in list.'})
+
+    def test_batch_uses_a_single_query(self):
+        # We call the view directly and only count SELECTs, so the
+        # queries silk adds in 'dev' settings (INSERTs, EXPLAINs) don't count.
+        ids = ','.join(str(p.pk) for p in self.products)
+        request = APIRequestFactory().get(f'/product/?ids={ids}')
+        view = ProductListCreateAPIView.as_view()
+        with CaptureQueriesContext(connection) as queries:
+            view(request).render()
+        selects = [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('SELECT')
+        ]
+        self.assertEqual(len(selects), 1)
+
+
+# --- 8. BULK ORDER CREATION ---
+
+
+class BulkOrderCreateTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user1', password='test')
+        cls.product = Product.objects.create(name='Watch',
+                                             description='',
+                                             price=Decimal('5.00'),
+                                             stock=3)
+
+    def test_each_order_succeeds_or_fails_on_its_own(self):
+        self.client.force_login(self.user)
+        payload = [
+            {'items': [{'product': self.product.pk, 'quantity': 2}]},
+            {'items': [{'product': 999, 'quantity': 1}]},  # unknown product
+            {'status': 'Nope'},  # invalid status
+            {'status': 'Confirmed', 'items': []},
+        ]
+        response = self.client.post('/orders/bulk/',
+                                    payload,
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (2, 2))
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['created', 'failed', 'failed', 'created'])
+
+        order = Order.objects.get(pk=data['results'][0]['order_id'])
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_database_errors_are_not_shown_to_the_client(self):
+        self.client.force_login(self.user)
+        payload = [{'items': [{'product': self.product.pk, 'quantity': 1}]}]
+        with mock.patch.object(OrderItem.objects, 'bulk_create',
+                               side_effect=DatabaseError('api_orderitem')):
+            with self.assertLogs('api.batch', 'ERROR'):
+                response = self.client.post('/orders/bulk/',
+                                            payload,
+                                            content_type='application/json')
+
+        result = response.json()['results'][0]
+        self.assertEqual(result['status'], 'failed')
+        self.assertNotIn('api_orderitem', json.dumps(result))
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_out_of_range_numbers_fail_their_order_only(self):
+        self.client.force_login(self.user)
+        payload = [
+            {'items': [{'product': 10**20, 'quantity': 1}]},
+            {'items': [{'product': self.product.pk, 'quantity': 10**12}]},
+            {'items': [{'product': self.product.pk, 'quantity': 1}]},
+        ]
+        response = self.client.post('/orders/bulk/',
+                                    payload,
+                                    content_type='application/json')
+
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results],
+                         ['failed', 'failed', 'created'])
+        self.assertIn('product', results[0]['errors']['items'][0])
+        self.assertIn('quantity', results[1]['errors']['items'][0])
+
+    def test_body_must_be_a_list(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/orders/bulk/', {},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# --- 9. IDEMPOTENCY KEYS ---
+
+
+class IdempotencyKeyTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user1', password='test')
+        cls.product = Product.objects.create(name='Watch',
+                                             description='',
+                                             price=Decimal('5.00'),
+                                             stock=3)
+
+    def post_order(self, key, quantity=1):
+        return self.client.post(
+            '/orders/', {
+                'status': 'Pending',
+                'items': [{'product': self.product.pk, 'quantity': quantity}]
+            },
+            content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        self.client.force_login(self.user)
+        first = self.post_order('abc')
+        second = self.post_order('abc')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_same_key_with_a_different_body_is_rejected(self):
+        self.client.force_login(self.user)
+        self.post_order('abc', quantity=1)
+        response = self.post_order('abc', quantity=2)
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_duplicate_of_an_in_flight_request_gets_409(self):
+        self.client.force_login(self.user)
+        self.post_order('abc')
+        # Pretend the first request is still running.
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+        response = self.post_order('abc')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+# --- 10. ADMIN ---
+
+
+def app_queries(captured):
+    """
+    The SQL our own code ran inside a 'CaptureQueriesContext', without
+    the queries silk adds to record every request in 'dev' settings
+    (they would make query counts random).
+    """
+    return [
+        q['sql'] for q in captured.captured_queries
+        if 'silk_' not in q['sql'] and not q['sql'].startswith('EXPLAIN')
+    ]
+
+
+class OrderAdminTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin',
+                                                  password='test')
+        cls.orders = [Order.objects.create(user=cls.admin) for _ in range(3)]
+
+    def test_bulk_confirm_action_updates_all_selected_orders(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            reverse('admin:api_order_changelist'), {
+                'action': 'mark_confirmed',
+                '_selected_action': [str(o.pk) for o in self.orders[:2]],
+            })
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(
+            Order.objects.filter(
+                status=Order.StatusChoices.CONFIRMED).count(), 2)
+
+    def test_changelist_query_count_does_not_grow_with_orders(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:api_order_changelist')
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        for _ in range(10):
+            Order.objects.create(user=self.admin)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+
+        self.assertEqual(len(app_queries(few)), len(app_queries(many)))
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads sqlite_stat1')
+    def test_paginator_uses_the_estimate_for_big_unfiltered_tables(self):
+        orders = Order.objects.order_by('pk')
+        self.assertIsNone(estimate_row_count(Order))  # never analyzed
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimate_row_count(Order), 3)
+        # Now the estimate is stale, so we can tell which count we got.
+        Order.objects.create(user=self.admin)
+
+        def count(queryset):
+            with CaptureQueriesContext(connection) as queries:
+                total = EstimatedCountPaginator(queryset, 10).count
+            exact = any('COUNT(' in sql for sql in app_queries(queries))
+            return total, exact
+
+        # 3 rows is below the threshold: exact count.
+        self.assertEqual(count(orders), (4, True))
+        with mock.patch.object(EstimatedCountPaginator, 'exact_count_below',
+                               3):
+            self.assertEqual(count(orders), (3, False))
+            # With a filter the whole table's estimate would be wrong.
+            self.assertEqual(count(orders.filter(user=self.admin)), (4, True))
+
+
+# --- 11. ORDER STATUS EVENTS (SSE) ---
+
+
+class OrderEventsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create_user(username='user1', password='test')
+        cls.user2 = User.objects.create_user(username='user2', password='test')
+
+    def read_stream(self, broker, user, count, last_event_id=None):
+        """Subscribes, publishes one event per user, reads 'count' chunks."""
+
+        async def read():
+            subscription = broker.subscribe(last_event_id)
+            for owner in (self.user2, self.user1):
+                broker.publish({'order_id': 'x', 'user_id': owner.pk})
+            stream = order_event_stream(user, subscription, heartbeat=0.01)
+            chunks = [await anext(stream) for _ in range(count)]
+            await stream.aclose()
+            return chunks
+
+        return async_to_sync(read)()
+
+    def test_users_only_receive_events_for_their_own_orders(self):
+        chunks = self.read_stream(InProcessBroker(), self.user1, 3)
+
+        self.assertEqual(chunks[0], 'retry: 3000\n\n')
+        self.assertIn(f'"user_id": {self.user1.pk}', chunks[1])
+        self.assertTrue(chunks[1].startswith('id: 2\n'))
+        self.assertEqual(chunks[2], ': keep-alive\n\n')
+
+    def test_last_event_id_replays_missed_events(self):
+        broker = InProcessBroker()
+        broker.publish({'order_id': 'missed', 'user_id': self.user1.pk})
+        chunks = self.read_stream(broker, self.user1, 2, last_event_id='0')
+        self.assertIn('"order_id": "missed"', chunks[1])
+
+    def test_redis_ignores_malformed_last_event_ids(self):
+        for last_event_id, expected in [('1700000000000-3', '1700000000000-3'),
+                                        ('0', '$'), ('1-2 junk', '$'),
+                                        (None, '$')]:
+            subscription = RedisSubscription(None, 'order-status',
+                                             last_event_id)
+            self.assertEqual(subscription.last_id, expected)
+
+    def test_status_change_is_published_after_commit(self):
+        order = Order.objects.create(user=self.user1)
+        broker = get_broker()
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = Order.StatusChoices.CONFIRMED
+            order.save()
+
+        _, data = broker._history[-1]
+        self.assertEqual(data['order_id'], str(order.pk))
+        self.assertEqual(
+            (data['previous_status'], data['status']), ('Pending', 'Confirmed'))
+
+    def test_stream_requires_authentication(self):
+        response = self.client.get('/orders/events/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+# --- 12. CHANGE FEED ---
+
+
+class ChangeFeedTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin',
+                                                  password='test')
+
+    def get_changes(self, since, limit=100):
+        self.client.force_login(self.admin)
+        return self.client.get(f'/changes/?since={since}&limit={limit}').json()
+
+    def test_feed_returns_only_changes_after_the_token(self):
+        start = self.get_changes(0)['next']
+        product = Product.objects.create(name='Watch',
+                                         description='',
+                                         price=Decimal('5.00'),
+                                         stock=3)
+        product.stock = 2
+        product.save()
+        product_id = product.pk
+        product.delete()
+
+        data = self.get_changes(start)
+        self.assertEqual([(c['model'], c['action']) for c in data['changes']],
+                         [('product', 'create'), ('product', 'update'),
+                          ('product', 'delete')])
+        self.assertTrue(all(c['id'] == str(product_id)
+                            for c in data['changes']))
+        # Deleted now, so there is no current data to send.
+        self.assertIsNone(data['changes'][0]['data'])
+        self.assertEqual(self.get_changes(data['next'])['changes'], [])
+
+    def test_feed_pages_with_has_more(self):
+        start = self.get_changes(0)['next']
+        for _ in range(3):
+            Order.objects.create(user=self.admin)
+
+        first = self.get_changes(start, limit=2)
+        second = self.get_changes(first['next'], limit=2)
+        self.assertTrue(first['has_more'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['changes']) + len(second['changes']), 3)
+        self.assertEqual(first['changes'][0]['data']['status'], 'Pending')
+
+    def test_events_committed_late_are_not_skipped(self):
+        start = self.get_changes(0)['next']
+        slow, fast = [
+            ChangeEvent.objects.create(model='product',
+                                       object_id=str(n),
+                                       action='create') for n in (1, 2)
+        ]
+        # The transaction that got the smaller 'seq' hasn't committed yet
+        # when a consumer reads the feed...
+        slow.delete()
+        seen = self.get_changes(start)
+        self.assertEqual([c['id'] for c in seen['changes']], ['2'])
+
+        # ... and commits afterwards: the consumer still gets it.
+        ChangeEvent.objects.create(seq=slow.seq,
+                                   model='product',
+                                   object_id='1',
+                                   action='create')
+        late = self.get_changes(seen['next'])
+        self.assertEqual([c['id'] for c in late['changes']], ['1'])
+
+    def test_numbering_nothing_is_a_single_read(self):
+        number_events()  # whatever the setup recorded
+        with CaptureQueriesContext(connection) as queries:
+            number_events()
+        sql = app_queries(queries)
+        self.assertEqual(len(sql), 1)
+        self.assertTrue(sql[0].startswith('SELECT'))
+
+    def test_bulk_orders_record_item_events_without_returned_ids(self):
+        product = Product.objects.create(name='Watch',
+                                         description='',
+                                         price=Decimal('5.00'),
+                                         stock=3)
+        self.client.force_login(self.admin)
+        # Like a database that can't return ids from a bulk insert.
+        with mock.patch.object(type(connection.features),
+                               'can_return_rows_from_bulk_insert', False):
+            self.client.post('/orders/bulk/', [{
+                'items': [{
+                    'product': product.pk,
+                    'quantity': 1
+                }]
+            }] * 2,
+                             content_type='application/json')
+
+        item_ids = {str(pk) for pk in OrderItem.objects.values_list('pk',
+                                                                  flat=True)}
+        self.assertEqual(len(item_ids), 2)
+        self.assertEqual(
+            set(
+                ChangeEvent.objects.filter(model='orderitem').values_list(
+                    'object_id', flat=True)), item_ids)
+
+    def test_compaction_keeps_only_the_latest_event_per_object(self):
+        product = Product.objects.create(name='Watch',
+                                         description='',
+                                         price=Decimal('5.00'),
+                                         stock=3)
+        for stock in (2, 1):
+            product.stock = stock
+            product.save()
+
+        call_command('compact_changes', days=0, stdout=io.StringIO())
+        events = ChangeEvent.objects.filter(model='product',
+                                            object_id=str(product.pk))
+        self.assertEqual([e.action for e in events], ['update'])
+
+    def test_feed_is_staff_only(self):
+        user = User.objects.create_user(username='user1', password='test')
+        self.client.force_login(user)
+        response = self.client.get('/changes/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+# --- 13. ORDER ARCHIVE ---
+
+
+class OrderArchiveTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user1', password='test')
+        cls.product = Product.objects.create(name='Watch',
+                                             description='',
+                                             price=Decimal('5.00'),
+                                             stock=3)
+        long_ago = timezone.now() - timedelta(days=400)
+
+        cls.old_done = Order.objects.create(
+            user=cls.user, status=Order.StatusChoices.CONFIRMED)
+        cls.old_item = OrderItem.objects.create(order=cls.old_done,
+                                                product=cls.product,
+                                                quantity=2)
+        cls.old_pending = Order.objects.create(user=cls.user)
+        cls.recent_done = Order.objects.create(
+            user=cls.user, status=Order.StatusChoices.CONFIRMED)
+        # 'auto_now_add' ignores values passed to create(), so backdate.
+        Order.objects.filter(
+            pk__in=[cls.old_done.pk, cls.old_pending.pk]).update(
+                created_at=long_ago)
+
+    def test_only_old_finished_orders_are_moved(self):
+        call_command('archive_orders', days=180, stdout=io.StringIO())
+
+        self.assertEqual(
+            list(ArchivedOrder.objects.values_list('pk', flat=True)),
+            [self.old_done.pk])
+        self.assertEqual(ArchivedOrder.objects.get().items.get().quantity, 2)
+        self.assertEqual(
+            set(Order.objects.values_list('pk', flat=True)),
+            {self.old_pending.pk, self.recent_done.pk})
+        self.assertEqual(
+            ChangeEvent.objects.filter(object_id=str(self.old_done.pk)).last()
+            .action, ChangeEvent.Actions.ARCHIVE)
+        # The items left the live table too: consumers hear about it.
+        self.assertEqual(
+            ChangeEvent.objects.filter(
+                model='orderitem',
+                object_id=str(self.old_item.pk)).last().action,
+            ChangeEvent.Actions.ARCHIVE)
+
+    def test_archive_survives_deleting_the_product(self):
+        call_command('archive_orders', days=180, stdout=io.StringIO())
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('9'))
+        self.product.delete()
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/orders/{self.old_done.pk}/')
+        self.assertEqual(response.json()['items'], [{
+            'product_name': 'Watch',
+            'product_price': '5.00',
+            'quantity': 2,
+            'item_subtotal': 10.0,
+        }])
+
+    def test_archive_is_read_only_when_the_date_filter_reaches_it(self):
+        call_command('archive_orders', days=180, stdout=io.StringIO())
+        self.client.force_login(self.user)
+
+        current = self.client.get('/orders/').json()
+        self.assertEqual(len(current), 2)
+
+        recent = (timezone.now() - timedelta(days=30)).isoformat()
+        with_archive = self.client.get('/orders/',
+                                       {'created_at__lt': recent}).json()
+        self.assertIn(str(self.old_done.pk),
+                      [order['order_id'] for order in with_archive])
+        self.assertEqual(with_archive[-1]['total_price'], 10.0)
+
+        only_recent = self.client.get('/orders/',
+                                      {'created_at__gt': recent}).json()
+        self.assertNotIn(str(self.old_done.pk),
+                         [order['order_id'] for order in only_recent])
+
+    def test_archived_order_can_still_be_retrieved(self):
+        call_command('archive_orders', days=180, stdout=io.StringIO())
+        self.client.force_login(self.user)
+        response = self.client.get(f'/orders/{self.old_done.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], 'Confirmed')
+
+
+# --- 14. PRODUCT IMAGE RENDITIONS ---
+
+
+class ProductImageTestCase(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media_root.name,
+                                      PRODUCT_IMAGE_WIDTHS=[200, 600, 1200])
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def set_image(self, product, color):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (800, 400), color).save(buffer, 'PNG')
+        product.image.save(f'{color}.png', ContentFile(buffer.getvalue()),
+                           save=False)
+        product.save()
+
+    def run_jobs(self):
+        # The rendition jobs delete old files after their commit.
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_jobs', workers=0, once=True, stats_every=0,
+                         stdout=io.StringIO())
+
+    def test_upload_creates_content_hashed_webp_renditions(self):
+        product = Product(name='Watch',
+                          description='',
+                          price=Decimal('5.00'),
+                          stock=3)
+        self.set_image(product, 'red')
+        self.assertEqual(product.image_renditions, {})
+        self.run_jobs()
+
+        product.refresh_from_db()
+        # 1200 is wider than the original, so it is skipped.
+        self.assertEqual(sorted(product.image_renditions, key=int),
+                         ['200', '600'])
+        name = product.image_renditions['200']
+        self.assertRegex(name, r'^product/renditions/[0-9a-f]{20}-200\.webp$')
+        with default_storage.open(name) as f, PILImage.open(f) as rendition:
+            self.assertEqual((rendition.format, rendition.size),
+                             ('WEBP', (200, 100)))
+
+        data = self.client.get(f'/product/{product.pk}/').json()
+        self.assertRegex(data['image_renditions']['600'],
+                         r'^http://testserver/.*-600\.webp$')
+
+    def test_superseded_renditions_are_deleted_when_unused(self):
+        watch, clock = (Product.objects.create(name=name,
+                                               description='',
+                                               price=Decimal('5.00'),
+                                               stock=3)
+                        for name in ('Watch', 'Clock'))
+        # Same picture: the two products share the rendition files.
+        self.set_image(watch, 'red')
+        self.set_image(clock, 'red')
+        self.run_jobs()
+        watch.refresh_from_db()
+        red = list(watch.image_renditions.values())
+
+        self.set_image(watch, 'blue')
+        self.run_jobs()
+        watch.refresh_from_db()
+        self.assertNotEqual(list(watch.image_renditions.values()), red)
+        # Still used by the clock.
+        self.assertTrue(all(default_storage.exists(name) for name in red))
+
+        clock.refresh_from_db()
+        clock.image = None
+        clock.save()
+        self.run_jobs()
+        self.assertFalse(any(default_storage.exists(name) for name in red))
+
+    def test_deleting_a_product_deletes_its_files(self):
+        product = Product.objects.create(name='Watch',
+                                         description='',
+                                         price=Decimal('5.00'),
+                                         stock=3)
+        self.set_image(product, 'red')
+        self.run_jobs()
+        product.refresh_from_db()
+        files = [product.image.name, *product.image_renditions.values()]
+        self.assertTrue(all(default_storage.exists(name) for name in files))
+
+        product.delete()
+        self.run_jobs()
+        self.assertFalse(any(default_storage.exists(name) for name in files))
+
+
+# --- 15. BACKGROUND JOBS ---
+
+# Jobs are looked up by dotted path ('api.tests.record_call'), so the
+# test tasks have to live at module level.
+job_calls = []
+
+
+def record_call(*args, **kwargs):
+    job_calls.append((args, kwargs))
+
+
+def always_fails():
+    raise RuntimeError('boom')
+
+
+class JobQueueTestCase(TestCase):
+
+    def setUp(self):
+        job_calls.clear()
+
+    def test_worker_runs_due_jobs_only(self):
+        enqueue(record_call, args=[1], kwargs={'b': 2})
+        later = enqueue(record_call, delay=3600)
+
+        call_command('run_jobs', workers=0, once=True, stdout=io.StringIO())
+
+        self.assertEqual(job_calls, [((1, ), {'b': 2})])
+        stats = queue_stats()
+        self.assertEqual(stats['depth']['done'], 1)
+        self.assertEqual(stats['depth']['scheduled'], 1)
+        self.assertEqual(stats['done_in_window'], 1)
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.Status.QUEUED)
+
+    def test_a_job_is_claimed_only_once(self):
+        for _ in range(3):
+            enqueue(record_call)
+        first = claim_jobs(2)
+        second = claim_jobs(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({job.pk for job in first} & {job.pk for job in second})
+        self.assertEqual(claim_jobs(2), [])
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        job = enqueue(always_fails, max_attempts=2)
+
+        with self.assertLogs('api.jobs', 'WARNING') as logs:
+            self.assertFalse(run_job(claim_jobs(1)[0]))
+        self.assertIn('failed, retrying in', logs.output[0])
+        self.assertIn('RuntimeError: boom', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 1))
+        self.assertIn('boom', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())  # not due yet
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('api.jobs', 'ERROR') as logs:
+            run_job(claim_jobs(1)[0])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('failed for good after 2 attempts', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 2))
+
+    def test_jobs_of_a_dead_worker_are_taken_back(self):
+        job = enqueue(record_call)
+        claim_jobs(1)
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() -
+                                             timedelta(hours=1))
+
+        self.assertEqual(requeue_stale(timeout=60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.QUEUED)
+
+    def test_process_workers_leave_inherited_connections_alone(self):
+        # What a forked worker would inherit: an open connection.
+        conn = connections['default']
+        conn.ensure_connection()
+        inherited = conn.connection
+        try:
+            init_worker()
+            # Forgotten (a new one would be opened on use), not closed.
+            self.assertIsNone(conn.connection)
+            self.assertIn(inherited, _inherited)
+            inherited.cursor().execute('SELECT 1')
+        finally:
+            _inherited.remove(inherited)
+            conn.connection = inherited
+
+    def test_stats_endpoint_is_staff_only(self):
+        user = User.objects.create_user(username='user1', password='test')
+        self.client.force_login(user)
+        self.assertEqual(
+            self.client.get('/jobs/stats/').status_code,
+            status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        user.save()
+        enqueue(record_call)
+        response = self.client.get('/jobs/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['depth']['due'], 1)
+
+
+# --- 16. SALES ROLLUPS ---
+
+
+def sales(model=ProductSalesDaily):
+    # {(product id, status): (units, revenue)}, or {status: ...} for the
+    # totals table.
+    if model is SalesDaily:
+        return {r.status: (r.units, r.revenue) for r in model.objects.all()}
+    return {(r.product_id, r.status): (r.units, r.revenue)
+            for r in model.objects.all()}
+
+
+class SalesRollupTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin',
+                                                  password='test')
+        cls.watch = Product.objects.create(name='Watch',
+                                           description='',
+                                           price=Decimal('5.00'),
+                                           stock=3)
+        cls.ring = Product.objects.create(name='Ring',
+                                          description='',
+                                          price=Decimal('20.00'),
+                                          stock=3)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_order(self, *items):
+        response = self.client.post('/orders/', {
+            'items': [{
+                'product': product.pk,
+                'quantity': quantity
+            } for product, quantity in items]
+        },
+                                    content_type='application/json')
+        return response.json()['order_id']
+
+    def test_rollups_follow_order_writes(self):
+        pending, confirmed = 'Pending', 'Confirmed'
+        order_id = self.create_order((self.watch, 2), (self.ring, 1))
+        self.assertEqual(
+            sales(), {
+                (self.watch.pk, pending): (2, Decimal('10.00')),
+                (self.ring.pk, pending): (1, Decimal('20.00')),
+            })
+        self.assertEqual(sales(SalesDaily), {pending: (3, Decimal('30.00'))})
+
+        self.client.patch(f'/orders/{order_id}/', {'status': confirmed},
+                          content_type='application/json')
+        self.assertEqual(sales(SalesDaily), {
+            pending: (0, Decimal('0.00')),
+            confirmed: (3, Decimal('30.00'))
+        })
+
+        # PUT replaces the items.
+        self.client.put(f'/orders/{order_id}/', {
+            'status': confirmed,
+            'items': [{
+                'product': self.watch.pk,
+                'quantity': 1
+            }]
+        },
+                        content_type='application/json')
+        self.assertEqual(sales()[(self.watch.pk, confirmed)],
+                         (1, Decimal('5.00')))
+        self.assertEqual(sales()[(self.ring.pk, confirmed)],
+                         (0, Decimal('0.00')))
+
+    def test_bulk_admin_and_archive_paths(self):
+        self.client.post('/orders/bulk/', [{
+            'items': [{
+                'product': self.ring.pk,
+                'quantity': 2
+            }]
+        }] * 2,
+                         content_type='application/json')
+        self.assertEqual(sales(SalesDaily), {'Pending': (4, Decimal('80.00'))})
+
+        update_order_status(Order.objects.all(), Order.StatusChoices.CONFIRMED)
+        self.assertEqual(sales(SalesDaily)['Confirmed'], (4, Decimal('80.00')))
+
+        # Archived orders were still sold.
+        before = sales()
+        archive_orders(older_than_days=-1)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(sales(), before)
+
+        # ... and the backfill finds them in the archive.
+        ProductSalesDaily.objects.all().delete()
+        call_command('backfill_sales_rollups', stdout=io.StringIO())
+        self.assertEqual(
+            {k: v for k, v in sales().items() if v[0]},
+            {k: v for k, v in before.items() if v[0]})
+
+    def test_items_keep_the_price_they_were_ordered_at(self):
+        order_id = self.create_order((self.watch, 2))
+        Product.objects.filter(pk=self.watch.pk).update(price=Decimal('7.00'))
+
+        data = self.client.get(f'/orders/{order_id}/').json()
+        self.assertEqual(data['items'][0]['product_price'], '5.00')
+        self.assertEqual(data['total_price'], 10.0)
+
+        # Taken away at the price it was added with: nothing left over.
+        self.client.put(f'/orders/{order_id}/', {
+            'items': [{
+                'product': self.ring.pk,
+                'quantity': 1
+            }]
+        },
+                        content_type='application/json')
+        self.assertEqual(sales()[(self.watch.pk, 'Pending')],
+                         (0, Decimal('0.00')))
+
+    def test_deleting_orders_doesnt_load_each_order_and_product(self):
+        for _ in range(3):
+            self.create_order((self.watch, 1), (self.ring, 2))
+        with CaptureQueriesContext(connection) as queries:
+            Order.objects.all().delete()
+        selects = [
+            q for q in app_queries(queries)
+            if re.match(r'SELECT .* FROM "api_(order|product)"( |$)', q)
+        ]
+        self.assertEqual(len(selects), 1)  # the orders to delete
+        self.assertEqual(sales(SalesDaily), {'Pending': (0, Decimal('0.00'))})
+
+    def test_replacing_items_doesnt_load_the_order_per_item(self):
+        order_id = self.create_order((self.watch, 1), (self.ring, 2),
+                                     (self.watch, 3))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.put(f'/orders/{order_id}/', {
+                'items': [{
+                    'product': self.ring.pk,
+                    'quantity': 1
+                }]
+            },
+                            content_type='application/json')
+        selects = [
+            q for q in app_queries(queries)
+            if re.match(r'SELECT .* FROM "api_order"( |$)', q)
+        ]
+        self.assertEqual(len(selects), 1)  # the order to update
+        self.assertEqual(sales(SalesDaily),
+                         {'Pending': (1, Decimal('20.00'))})
+
+    def test_any_accepted_quantity_fits_the_totals(self):
+        # Far too much for the old 14 digits, but still exact in the
+        # float SQLite keeps decimals in.
+        dearest = Product.objects.create(name='Yacht',
+                                         description='',
+                                         price=Decimal('1000000.00'),
+                                         stock=1)
+        big = OrderItem.MAX_QUANTITY
+        for quantity in (big + 1, -1):
+            response = self.client.post('/orders/', {
+                'items': [{
+                    'product': dearest.pk,
+                    'quantity': quantity
+                }]
+            },
+                                        content_type='application/json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+        self.create_order((dearest, big), (dearest, big))
+        total = 2 * big * dearest.price
+        self.assertEqual(sales(SalesDaily), {'Pending': (2 * big, total)})
+        self.assertEqual(
+            UserOrderSummary.objects.get(user=self.admin).spent, total)
+
+    def test_analytics_endpoint(self):
+        self.create_order((self.watch, 2))
+        self.create_order((self.ring, 1))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/analytics/sales/', {'top': 1})
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(data['series']), 30)
+        self.assertEqual(data['series'][-1]['units'], 3)
+        self.assertEqual(data['totals']['revenue'], 30.0)
+        self.assertEqual(data['top_products'], [{
+            'product_id': self.ring.pk,
+            'name': 'Ring',
+            'units': 1,
+            'revenue': 20.0
+        }])
+        # Session, user, series, top products, product names. However
+        # many orders there are.
+        selects = [q for q in app_queries(queries) if q.startswith('SELECT')]
+        self.assertEqual(len(selects), 5)
+
+        self.assertEqual(
+            self.client.get('/analytics/sales/', {
+                'status': 'Shipped'
+            }).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# --- 17. USER ORDER SUMMARIES ---
+
+
+class UserOrderSummaryTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user1', password='test')
+        cls.other = User.objects.create_user(username='user2', password='test')
+        cls.watch = Product.objects.create(name='Watch',
+                                           description='',
+                                           price=Decimal('5.00'),
+                                           stock=3)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def order(self, quantity):
+        return self.client.post('/orders/', {
+            'items': [{
+                'product': self.watch.pk,
+                'quantity': quantity
+            }]
+        },
+                                content_type='application/json').json()
+
+    def test_summary_follows_order_writes(self):
+        first = self.order(2)
+        self.order(1)
+        self.client.patch(f"/orders/{first['order_id']}/",
+                          {'status': 'Cancelled'},
+                          content_type='application/json')
+
+        summary = self.client.get('/orders/summary/').json()
+        self.assertEqual(summary['total_orders'], 2)
+        self.assertEqual(summary['pending_orders'], 1)
+        self.assertEqual(summary['cancelled_orders'], 1)
+        self.assertEqual(summary['spent'], '5.00')  # cancelled don't count
+        self.assertIsNotNone(summary['last_order_at'])
+
+        self.client.delete(f"/orders/{first['order_id']}/")
+        summary = self.client.get('/orders/summary/').json()
+        self.assertEqual(summary['total_orders'], 1)
+
+    def test_deleting_the_newest_order_moves_last_order_at_back(self):
+        older, newest = self.order(1), self.order(1)
+        yesterday = timezone.now() - timedelta(days=1)
+        Order.objects.filter(pk=older['order_id']).update(created_at=yesterday)
+
+        self.client.delete(f"/orders/{newest['order_id']}/")
+        self.assertEqual(
+            UserOrderSummary.objects.get(user=self.user).last_order_at,
+            yesterday)
+
+        # Archived orders still count.
+        update_order_status(Order.objects.all(), Order.StatusChoices.CONFIRMED)
+        archive_orders(older_than_days=-1)
+        self.assertEqual(
+            UserOrderSummary.objects.get(user=self.user).last_order_at,
+            yesterday)
+
+    def test_staff_summary_of_another_user(self):
+        staff = User.objects.create_superuser(username='admin',
+                                              password='test')
+        self.client.force_login(staff)
+        response = self.client.get('/orders/summary/', {'user': self.other.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['total_orders'], 0)
+
+        response = self.client.get('/orders/summary/', {'user': 999999})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        for bad in ('me', '99999999999999999999', ''):
+            response = self.client.get('/orders/summary/', {'user': bad})
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json(), {'user': 'Must be a user id.'})
+
+    def test_optional_user_serializer_field(self):
+        self.order(2)
+        users = self.client.get('/api/users/').json()
+        self.assertNotIn('order_summary', users[0])
+
+        users = {
+            u['username']: u
+            for u in self.client.get('/api/users/', {
+                'include': 'order_summary'
+            }).json()
+        }
+        self.assertEqual(users['user1']['order_summary']['spent'], '10.00')
+        # Other users' spending is not shown to non-staff.
+        self.assertIsNone(users['user2']['order_summary'])
+
+    def test_reconcile_detects_and_repairs_drift(self):
+        self.order(2)
+        UserOrderSummary.objects.filter(user=self.user).update(
+            pending_orders=7, spent=0)
+
+        out = io.StringIO()
+        call_command('reconcile_order_summaries', stdout=out)
+        self.assertIn('pending_orders 7 != 1', out.getvalue())
+        self.assertEqual(
+            UserOrderSummary.objects.get(user=self.user).pending_orders, 7)
+
+        call_command('reconcile_order_summaries', fix=True, stdout=out)
+        summary = UserOrderSummary.objects.get(user=self.user)
+        self.assertEqual((summary.pending_orders, summary.spent),
+                         (1, Decimal('10.00')))
+
+    def test_deleting_a_user_with_orders(self):
+        archived = self.order(1)
+        update_order_status(Order.objects.all(), Order.StatusChoices.CONFIRMED)
+        archive_orders(older_than_days=-1)
+        self.order(2)
+        self.user.delete()
+        self.assertFalse(UserOrderSummary.objects.exists())
+
+        self.assertFalse(ArchivedOrder.objects.filter(
+            pk=archived['order_id']).exists())
+
+        # Their sales are gone from the rollups, live and archived ones:
+        # the same as what the backfill finds.
+        def sold():
+            return {k: v for k, v in sales(SalesDaily).items() if v[0]}
+
+        self.assertEqual(sold(), {})
+        call_command('backfill_sales_rollups', stdout=io.StringIO())
+        self.assertEqual(sold(), {})
+
+
+# --- 18. PRODUCT FACETS ---
+
+
+class ProductFacetsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for price, stock in [('5.00', 0), ('20.00', 3), ('30.00', 1),
+                             ('700.00', 2)]:
+            Product.objects.create(name=f'Watch {price}',
+                                   description='',
+                                   price=Decimal(price),
+                                   stock=stock)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_facets_follow_the_filters(self):
+        data = self.client.get('/product/', {'facets': 1}).json()
+        facets = data['facets']
+        self.assertEqual(facets['total'], 4)
+        self.assertEqual(facets['stock'], {'in_stock': 3, 'out_of_stock': 1})
+        self.assertEqual([b['count'] for b in facets['price']],
+                         [1, 2, 0, 0, 1])
+        self.assertEqual(facets['price'][1], {
+            'min': 10,
+            'max': 50,
+            'count': 2
+        })
+        self.assertEqual(len(data['results']), 2)  # still paginated
+
+        filtered = self.client.get('/product/', {
+            'facets': 1,
+            'price__lt': 100
+        }).json()['facets']
+        self.assertEqual(filtered['total'], 3)
+
+    def test_one_query_then_cached_until_a_product_changes(self):
+        url = '/product/'
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url, {'facets': 1})
+        with CaptureQueriesContext(connection) as other_page:
+            self.client.get(url, {'facets': 1, 'pagenum': 2})
+        self.assertEqual(len(app_queries(first)), len(app_queries(plain)) + 1)
+        self.assertEqual(len(app_queries(other_page)),
+                         len(app_queries(plain)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Ring',
+                                   description='',
+                                   price=Decimal('1.00'),
+                                   stock=1)
+        facets = self.client.get(url, {'facets': 1}).json()['facets']
+        self.assertEqual(facets['total'], 5)
+
+
+# --- 19. THROTTLING AND LOAD SHEDDING ---
+
+# Small buckets so a few requests are enough: 'product/info/' costs 10
+# tokens, so anonymous clients get 2 calls, staff 5.
+SMALL_BUCKETS = {
+    'catalog': {
+        'anon': (20, 0.01),
+        'user': (30, 0.01),
+        'staff': (50, 0.01)
+    },
+}
+
+
+@override_settings(API_TOKEN_BUCKETS=SMALL_BUCKETS,
+                   API_THROTTLE_BACKEND='local',
+                   API_CONCURRENCY_LIMITS={'expensive': 2},
+                   API_CONCURRENCY_RETRY_AFTER=3)
+class ThrottlingTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin',
+                                                  password='test')
+        cls.product = Product.objects.create(name='Watch',
+                                             description='',
+                                             price=Decimal('5.00'),
+                                             stock=10)
+
+    def setUp(self):
+        local_buckets.clear()
+
+    def calls_allowed(self, tries=10):
+        codes = [self.client.get('/product/info/').status_code
+                 for _ in range(tries)]
+        return codes.count(status.HTTP_200_OK)
+
+    def test_bucket_size_depends_on_the_user(self):
+        self.assertEqual(self.calls_allowed(), 2)
+        response = self.client.get('/product/info/')
+        self.assertEqual(response.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        # 10 tokens at 0.01 per second
+        self.assertEqual(int(response['Retry-After']), 1000)
+
+        self.client.force_login(self.admin)
+        self.assertEqual(self.calls_allowed(), 5)
+
+    def test_forwarded_for_header_doesnt_make_a_new_client(self):
+        codes = [
+            self.client.get('/product/info/',
+                            HTTP_X_FORWARDED_FOR=f'10.0.0.{n}').status_code
+            for n in range(5)
+        ]
+        self.assertEqual(codes.count(status.HTTP_200_OK), 2)
+
+    def test_sheds_load_when_the_budget_is_taken(self):
+        # Two expensive requests "in flight" in other threads.
+        limiter = get_limiter('expensive')
+        self.assertTrue(limiter.acquire(blocking=False))
+        self.assertTrue(limiter.acquire(blocking=False))
+        try:
+            busy = self.client.get('/product/info/')
+            self.client.force_login(self.admin)
+            users = self.client.get('/api/users/')
+            # Orders aren't part of the budget: still placed right away.
+            order = self.client.post('/orders/', {
+                'items': [{
+                    'product': self.product.pk,
+                    'quantity': 1
+                }]
+            },
+                                     content_type='application/json')
+        finally:
+            limiter.release()
+            limiter.release()
+
+        for response in (busy, users):
+            self.assertEqual(response.status_code,
+                             status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(order.status_code, status.HTTP_201_CREATED)
+
+        # Slots come back after each request, errors included.
+        self.assertEqual(self.client.get('/api/users/').status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/users/').status_code,
+                         status.HTTP_200_OK)
+
+    def test_slots_come_back_after_unhandled_errors(self):
+        self.client.force_login(self.admin)
+        self.client.raise_request_exception = False
+        with mock.patch.object(UserListView,
+                               'get',
+                               side_effect=RuntimeError('boom')):
+            for _ in range(2):
+                self.assertEqual(self.client.get('/api/users/').status_code,
+                                 status.HTTP_500_INTERNAL_SERVER_ERROR)
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/users/').status_code,
+                             status.HTTP_200_OK)
+
+    def test_local_buckets_drop_only_refilled_buckets(self):
+        buckets = LocalBuckets()
+        buckets.max_buckets, buckets.prune_interval = 3, 0
+        # Empty, and slow to refill.
+        self.assertEqual(buckets.take('slow', 10, 10, 0.01), 0)
+        # Refilled almost at once: idle by the next request.
+        for n in range(5):
+            self.assertEqual(buckets.take(f'fast-{n}', 1, 5, 10**9), 0)
+        self.assertLessEqual(len(buckets.buckets), 3)
+        self.assertGreater(buckets.take('slow', 10, 10, 0.01), 0)
+
+        # Nothing refilled: the least recently used ones go.
+        buckets.prune_interval = 3600
+        for key in ('a', 'b', 'c'):
+            buckets.take(key, 10, 10, 0.01)
+        self.assertEqual(list(buckets.buckets), ['a', 'b', 'c'])
+
+    def test_cache_buckets_dont_overspend_under_concurrency(self):
+        buckets, key = CacheBuckets(), f'test:{uuid.uuid4()}'
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            waits = list(
+                pool.map(lambda _: buckets.take(key, 10, 20, 0.01),
+                         range(8)))
+        self.assertEqual(waits.count(0), 2)
+        # Refused until the window (20 / 0.01 seconds) is over.
+        self.assertTrue(all(0 < wait <= 2000 for wait in waits if wait))
+
+
+# --- 20. TESTS ON A SEEDED DATASET ---
+
+# 'SeededTestCase' (api/testing.py) starts every test with thousands of
+# rows. They're loaded once for the class, from a snapshot, instead of
+# being created by each test.
+
+
+class SeededDatasetTestCase(SeededTestCase):
+    dataset = 'medium'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create_superuser(username='admin',
+                                                  password='test')
+
+    def setUp(self):
+        local_buckets.clear()
+
+    def test_dataset_and_its_rollups(self):
+        self.assertEqual(len(self.users), 100)
+        self.assertEqual(len(self.products), 500)
+        self.assertEqual(Order.objects.count(), 5000)
+
+        # The factories kept the rollups in step with the orders.
+        units = OrderItem.objects.aggregate(n=Sum('quantity'))['n']
+        self.assertEqual(SalesDaily.objects.aggregate(n=Sum('units'))['n'],
+                         units)
+        user_ids = [user.pk for user in self.users]
+        stored = {
+            row.pop('user_id'): row
+            for row in UserOrderSummary.objects.values()
+        }
+        self.assertEqual(stored, actual_order_summaries(user_ids))
+
+    def test_order_summaries_cost_no_query_per_user(self):
+        self.client.force_login(self.admin)
+
+        def selects(params):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/api/users/', params)
+            self.assertEqual(len(response.json()), 101)
+            return [
+                sql for sql in app_queries(captured)
+                if sql.startswith('SELECT')
+            ]
+
+        self.assertEqual(len(selects({'include': 'order_summary'})),
+                         len(selects({})))
+
+    def test_each_user_sees_only_their_orders(self):
+        user = self.users[0]
+        self.client.force_login(user)
+        orders = self.client.get('/orders/').json()
+        self.assertEqual(len(orders), user.orders.count())
+        self.assertTrue(all(order['user'] == user.pk for order in orders))
+
+    def test_snapshots_are_made_again_the_next_day(self):
+        today = timezone.localdate()
+        path = snapshot_path('small')
+        with mock.patch('api.testing.timezone.localdate',
+                        return_value=today + timedelta(days=1)):
+            self.assertNotEqual(snapshot_path('small'), path)
+        self.assertEqual(snapshot_path('small'), path)
+
+    def test_old_snapshots_are_pruned(self):
+        with tempfile.TemporaryDirectory() as directory:
+
+            def touch(name, age=0):
+                path = os.path.join(directory, name)
+                open(path, 'w').close()
+                os.utime(path, (time.time() - age, ) * 2)
+                return path
+
+            current = touch('small-new.sqlite3')
+            touch('small-old.sqlite3')
+            touch('medium-abc.sqlite3')
+            touch('small-new.sqlite3.123.tmp', age=7200)
+            touch('small-new.sqlite3.456.tmp')  # still being written
+
+            prune_snapshots(current)
+            self.assertEqual(sorted(os.listdir(directory)), [
+                'medium-abc.sqlite3', 'small-new.sqlite3',
+                'small-new.sqlite3.456.tmp'
+            ])
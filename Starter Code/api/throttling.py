@@ -0,0 +1,210 @@
+"""
+Protection for the expensive endpoints ('/product/info/' dumps the whole
+catalog, '/api/users/' every user), so a burst of calls to them can't
+take all the workers and slow down order placement.
+
+Two tools, both configured in settings:
+
+- 'TokenBucketThrottle' (429 + 'Retry-After'): each client has a bucket
+  of tokens per endpoint ("scope") that refills at a steady rate. A
+  request takes as many tokens as the view's 'throttle_cost', so an
+  expensive endpoint runs dry sooner than a cheap one. Anonymous,
+  authenticated and staff users have their own sizes/rates.
+
+- 'ConcurrencyLimitMixin' (503 + 'Retry-After'): at most N expensive
+  requests run at the same time in this process. The others are turned
+  away at once instead of queueing up behind them.
+"""
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+
+class LocalBuckets:
+    """
+    Buckets in this process's memory: fast and exact, but every server
+    process counts on its own.
+    """
+    # At most this many buckets. Past it, the ones that have refilled
+    # (idle clients) are dropped, then if need be the least recently
+    # used ones.
+    max_buckets = 10000
+    # Looking for refilled buckets goes through all of them: at most
+    # once per this many seconds.
+    prune_interval = 1
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> (tokens, time of last update, capacity, rate), least
+        # recently used first. Buckets of different scopes and kinds of
+        # user have different sizes, so each keeps its own.
+        self.buckets = collections.OrderedDict()
+        self.next_prune = 0
+
+    def take(self, key, cost, capacity, rate):
+        """
+        Takes 'cost' tokens if there are enough and returns 0, or
+        returns how many seconds to wait until there will be.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated, _, _ = self.buckets.pop(
+                key, (capacity, now, capacity, rate))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / rate
+            # (Re)inserted at the end: the most recently used.
+            self.buckets[key] = (tokens, now, capacity, rate)
+            if len(self.buckets) > self.max_buckets:
+                if now >= self.next_prune:
+                    self.prune(now)
+                    self.next_prune = now + self.prune_interval
+                while len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+        return wait
+
+    def prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket.
+        full = [
+            key
+            for key, (tokens, updated, capacity, rate) in self.buckets.items()
+            if tokens + (now - updated) * rate >= capacity
+        ]
+        for key in full:
+            del self.buckets[key]
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBuckets:
+    """
+    Buckets in the Django cache: shared by all processes when the cache
+    is (Redis, Memcached).
+
+    A read-modify-write of the bucket would let parallel requests spend
+    the same tokens, so instead each bucket is a counter of the tokens
+    taken in a window of 'capacity / rate' seconds (the time a bucket
+    takes to refill), changed only with the cache's atomic 'add' and
+    'incr'. Within a window nobody gets more than 'capacity'; right at
+    the start of a new one a client can spend its next budget at once.
+    """
+
+    def take(self, key, cost, capacity, rate):
+        now = time.time()  # shared between machines, so wall clock
+        window = capacity / rate
+        start = now - now % window
+        key = f'{key}:{int(start)}'
+        cache.add(key, 0, timeout=int(window) + 1)
+        try:
+            taken = cache.incr(key, cost)
+        except ValueError:
+            return 0  # evicted in between: let this one through
+        if taken <= capacity:
+            return 0
+        # Refused requests don't use up the budget.
+        cache.decr(key, cost)
+        return start + window - now
+
+    def clear(self):
+        pass  # entries expire by themselves
+
+
+local_buckets = LocalBuckets()
+
+
+def get_buckets():
+    if settings.API_THROTTLE_BACKEND == 'cache':
+        return CacheBuckets()
+    return local_buckets
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket per client and view. The view sets 'throttle_scope'
+    (a key of 'API_TOKEN_BUCKETS') and optionally 'throttle_cost'
+    (tokens per request, default 1).
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        limits = settings.API_TOKEN_BUCKETS.get(scope)
+        if limits is None:
+            return True
+
+        user = request.user
+        if user and user.is_authenticated:
+            kind = 'staff' if user.is_staff else 'user'
+            ident = f'user-{user.pk}'
+        else:
+            kind, ident = 'anon', f'ip-{self.get_ident(request)}'
+        capacity, rate = limits[kind]
+        cost = getattr(view, 'throttle_cost', 1)
+
+        self.delay = get_buckets().take(f'throttle:{scope}:{ident}', cost,
+                                         capacity, rate)
+        return self.delay == 0
+
+    def wait(self):
+        return self.delay
+
+
+class ServiceOverloaded(Throttled):
+    """
+    Like a 429 'Throttled', but it's the server that is busy, not the
+    client asking too much: 503 'Service Unavailable' + 'Retry-After'.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The server is busy, please try again shortly.'
+    default_code = 'overloaded'
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(scope):
+    """One semaphore per scope of 'API_CONCURRENCY_LIMITS'."""
+    size = settings.API_CONCURRENCY_LIMITS[scope]
+    with _limiters_lock:
+        if (scope, size) not in _limiters:
+            _limiters[(scope, size)] = threading.BoundedSemaphore(size)
+        return _limiters[(scope, size)]
+
+
+class ConcurrencyLimitMixin:
+    """
+    Lets at most 'API_CONCURRENCY_LIMITS[concurrency_scope]' requests of
+    the views sharing that scope run at once (per process); the rest get
+    a 503 right away. Views in the same scope share the budget.
+    """
+    concurrency_scope = None
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication, permissions and throttles come first: a request
+        # that would be refused anyway must not take a slot.
+        super().initial(request, *args, **kwargs)
+        limiter = get_limiter(self.concurrency_scope)
+        if not limiter.acquire(blocking=False):
+            raise ServiceOverloaded(wait=settings.API_CONCURRENCY_RETRY_AFTER)
+        self.concurrency_slot = limiter
+
+    def dispatch(self, request, *args, **kwargs):
+        self.concurrency_slot = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # Whatever happened, errors DRF doesn't handle (500s) too.
+            slot, self.concurrency_slot = self.concurrency_slot, None
+            if slot is not None:
+                slot.release()
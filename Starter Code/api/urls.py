@@ -6,7 +6,12 @@ urlpatterns = [
     path('product/', views.ProductListCreateAPIView.as_view()),
     path('product/<int:product_id>/', views.ProductDetailAPIView.as_view()),
     path('product/info/', views.ProductInfoAPIView.as_view()),
-    path('api/users/', views.UserListView.as_view())
+    path('api/users/', views.UserListView.as_view()),
+    # Must come before the router, or 'events' would be read as an order id.
+    path('orders/events/', views.order_events),
+    path('changes/', views.ChangeFeedAPIView.as_view()),
+    path('jobs/stats/', views.JobStatsAPIView.as_view()),
+    path('analytics/sales/', views.SalesAnalyticsAPIView.as_view()),
 ]
 
 router = DefaultRouter()
@@ -1,23 +1,49 @@
-from django.db.models import Max
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Max, Sum
+from django.http import (Http404, HttpResponseNotAllowed, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, generics, viewsets
+from rest_framework import filters, generics, serializers, status, viewsets
 from rest_framework.pagination import (LimitOffsetPagination,
                                        PageNumberPagination)
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from api.filters import InStockFilterBackend, OrderFilter, ProductFilter
-from api.models import Order, Product, User
+from api.archive import reaches_archive
+from api.batch import BatchRetrieveMixin, create_orders_in_bulk
+from api.changes import current_data, number_events
+from api.events import SubscriptionLost, get_broker
+from api.facets import FacetsMixin
+from api.filters import (ArchivedOrderFilter, InStockFilterBackend,
+                         OrderFilter, ProductFilter)
+from api.idempotency import idempotent
+from api.jobs import queue_stats
+from api.models import (ArchivedOrder, ChangeEvent, Order, Product,
+                        ProductSalesDaily, SalesDaily, User,
+                        UserOrderSummary)
 from api.serializers import (
+    ArchivedOrderSerializer,
+    OrderBulkCreateSerializer,
     OrderSerializer,
     ProductInfoSerializer,
     ProductSerializer,
     OrderCreateSerializer,
+    SalesAnalyticsQuerySerializer,
+    UserOrderSummarySerializer,
     UserSerializer,
 )
+from api.throttling import ConcurrencyLimitMixin, TokenBucketThrottle
 
 # --- "GENERIC" CLASS-BASED VIEWS (The easy way) ---
 # These are pre-built views from DRF that handle common patterns.
@@ -110,7 +136,7 @@ from api.serializers import (
 #     return Response(serializer.data)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(BatchRetrieveMixin, viewsets.ModelViewSet):
     queryset = Order.objects.prefetch_related('items__product')
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
@@ -118,6 +144,16 @@ class OrderViewSet(viewsets.ModelViewSet):
     filterset_class = OrderFilter
     filter_backends = [DjangoFilterBackend]
 
+    # Retries that send the same 'Idempotency-Key' header get the first
+    # response back instead of creating a duplicate (see api/idempotency.py).
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -125,6 +161,8 @@ class OrderViewSet(viewsets.ModelViewSet):
         # you can check if it post direct but he choose create here by self.request.method =='post'
         if self.action == 'create' or self.action == 'update':
             return OrderCreateSerializer
+        if self.action == 'bulk':
+            return OrderBulkCreateSerializer
         return super().get_serializer_class()
 
     def get_queryset(self):
@@ -133,14 +171,139 @@ class OrderViewSet(viewsets.ModelViewSet):
             qs = qs.filter(user=self.request.user)
         return qs
 
+    def get_archived_queryset(self):
+        # Same rules as 'get_queryset', but on the archive tables.
+        qs = ArchivedOrder.objects.prefetch_related('items')
+        if not self.request.user.is_staff:
+            qs = qs.filter(user=self.request.user)
+        return qs
 
-class ProductInfoAPIView(APIView):
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+
+        # Old, finished orders live in the archive tables (see
+        # api/archive.py). We only read them when the date filter asks
+        # for orders that old, so normal requests never touch the archive.
+        if self.batch_query_param not in request.query_params:
+            archived = ArchivedOrderFilter(
+                request.query_params, queryset=self.get_archived_queryset())
+            if archived.is_valid() and reaches_archive(
+                    archived.form.cleaned_data):
+                response.data = [
+                    *response.data,
+                    *ArchivedOrderSerializer(archived.qs, many=True).data
+                ]
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Someone following an old link: try the archive.
+            # (DRF's version also turns a malformed UUID into a 404)
+            order = generics.get_object_or_404(self.get_archived_queryset(),
+                                               pk=kwargs['pk'])
+            return Response(ArchivedOrderSerializer(order).data)
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        GET '/orders/summary/': the user's number of orders per status,
+        total spent and last order time, read from the counters in
+        'UserOrderSummary' (one query, however many orders there are).
+        Staff can ask for another user with '?user=<id>'.
+        """
+        user_id = request.user.pk
+        if request.user.is_staff and 'user' in request.query_params:
+            # Parsed and checked by the primary key field: its validators
+            # reject numbers too big for the column (which would only
+            # fail in the database).
+            pk_field = User._meta.pk
+            try:
+                user_id = pk_field.to_python(request.query_params['user'])
+                pk_field.run_validators(user_id)
+            except DjangoValidationError:
+                raise serializers.ValidationError(
+                    {'user': 'Must be a user id.'})
+        summary = UserOrderSummary.objects.filter(user_id=user_id).first()
+        if summary is None:
+            # No orders yet, or no such user (only worth a query when
+            # staff asked for someone else).
+            if user_id != request.user.pk and not User.objects.filter(
+                    pk=user_id).exists():
+                raise Http404
+            summary = UserOrderSummary(user_id=user_id)
+        return Response(UserOrderSummarySerializer(summary).data)
+
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def bulk(self, request):
+        """
+        POST '/orders/bulk/' with a JSON *list* of orders (same shape as
+        'POST /orders/') creates all of them in one request.
+
+        Every order succeeds or fails on its own. The response has one
+        entry per order, in the order they were sent:
+            {"index": 0, "status": "created", "order_id": "..."}
+            {"index": 1, "status": "failed", "errors": {...}}
+        201 if everything was created, 207 (Multi-Status) otherwise.
+        """
+        if not isinstance(request.data, list):
+            raise serializers.ValidationError(
+                {'non_field_errors': ['Expected a list of orders.']})
+
+        max_orders = getattr(settings, 'API_BULK_ORDERS_MAX', 5000)
+        if len(request.data) > max_orders:
+            raise serializers.ValidationError({
+                'non_field_errors':
+                [f'At most {max_orders} orders per request.']
+            })
+
+        # Validate each order on its own so one bad order doesn't reject
+        # the whole request.
+        child = self.get_serializer()
+        valid, results = [], [None] * len(request.data)
+        for index, entry in enumerate(request.data):
+            try:
+                valid.append((index, child.run_validation(entry)))
+            except serializers.ValidationError as exc:
+                results[index] = {
+                    'index': index,
+                    'status': 'failed',
+                    'errors': exc.detail,
+                }
+
+        created = create_orders_in_bulk(
+            request.user, [data for _, data in valid],
+            chunk_size=getattr(settings, 'API_BULK_ORDERS_CHUNK_SIZE', 500))
+        for (index, _), result in zip(valid, created):
+            results[index] = {'index': index, **result}
+
+        failed = sum(result['status'] == 'failed' for result in results)
+        return Response(
+            {
+                'created': len(results) - failed,
+                'failed': failed,
+                'results': results,
+            },
+            status=status.HTTP_207_MULTI_STATUS
+            if failed else status.HTTP_201_CREATED)
+
+
+class ProductInfoAPIView(ConcurrencyLimitMixin, APIView):
     """
     Handles GET requests to '/product/info/'
     This view uses the base 'APIView', so we have to build the
     'get' method ourselves. This is for when "generic" views aren't
     flexible enough, like when you need to combine data.
+
+    It returns the whole catalog, so it's rate limited and shares the
+    'expensive' concurrency budget (see api/throttling.py).
     """
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'catalog'
+    throttle_cost = 10
+    concurrency_scope = 'expensive'
 
     def get(self, request):
         # 1. Get the data from the database
@@ -162,9 +325,13 @@ class ProductInfoAPIView(APIView):
         return Response(serializer.data)
 
 
-class ProductListCreateAPIView(generics.ListCreateAPIView):
+class ProductListCreateAPIView(BatchRetrieveMixin, FacetsMixin,
+                               generics.ListCreateAPIView):
     """
     Handles GET & POST requests to '/products/'
+    ('/products/?ids=1,2,3' returns several products in one go,
+    see 'BatchRetrieveMixin'; '?facets=1' adds price/stock counts,
+    see 'FacetsMixin')
     """
     # We can apply a permanent filter to the queryset.
     # This endpoint will *only* ever show products with stock > 0.
@@ -211,7 +378,254 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         return super().get_permissions()
 
 
-class UserListView(generics.ListAPIView):
+class ChangeFeedAPIView(APIView):
+    """
+    Handles GET '/changes/?since=<token>&limit=<n>' (staff only).
+
+    Returns what changed (products, orders, order items) after 'since',
+    oldest first, with the current data of each object:
+
+        {"changes": [{"seq": 41, "model": "product", "id": "3",
+                      "action": "update", "data": {...}}, ...],
+         "next": "41", "has_more": false}
+
+    Start with 'since=0', then always pass the 'next' you got back.
+    Treat "create" and "update" the same way (insert-or-update): old
+    events get compacted ('manage.py compact_changes'), so you may only
+    see the latest event of an object.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(
+                request.query_params.get('limit',
+                                         settings.CHANGES_PAGE_SIZE))
+        except ValueError:
+            raise serializers.ValidationError(
+                {'since': 'Must be a token returned by this endpoint.'})
+        limit = max(1, min(limit, settings.CHANGES_MAX_PAGE_SIZE))
+
+        # The token is the event's 'position', given once it's committed
+        # (see 'number_events'), so events of a slow transaction can't be
+        # skipped by a consumer that has already moved on.
+        number_events()
+        events = ChangeEvent.objects.filter(
+            position__gt=since).order_by('position')
+
+        # Fetch one extra row to know if there is more after this page.
+        events = list(events[:limit + 1])
+        has_more = len(events) > limit
+        events = events[:limit]
+
+        data = current_data(events)
+        return Response({
+            'changes': [{
+                'seq': event.position,
+                'model': event.model,
+                'id': event.object_id,
+                'action': event.action,
+                'data': data.get((event.model, event.object_id)),
+            } for event in events],
+            'next': str(events[-1].position if events else since),
+            'has_more': has_more,
+        })
+
+
+class SalesAnalyticsAPIView(APIView):
+    """
+    Handles GET '/analytics/sales/' (staff only):
+
+        ?start=2024-01-01&end=2024-01-31   (default: last 30 days)
+        &status=Pending,Confirmed          (default: not cancelled)
+        &top=10&order_by=revenue|units
+
+    Returns the totals, one point per day ('series', days without sales
+    included as zeros) and the 'top' products of the period. Everything
+    is read from the daily rollups (api/rollups.py): the work depends on
+    the number of days and products sold, not on the number of orders.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = SalesAnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        start, end, statuses = (params.validated_data['start'],
+                                params.validated_data['end'],
+                                params.validated_data['status'])
+        order_by = params.validated_data['order_by']
+        in_period = {
+            'day__gte': start,
+            'day__lte': end,
+            'status__in': statuses,
+        }
+
+        per_day = {
+            row['day']: row
+            for row in SalesDaily.objects.filter(**in_period).values(
+                'day').annotate(units=Sum('units'), revenue=Sum(
+                    'revenue')).order_by()
+        }
+        series = []
+        day = start
+        while day <= end:
+            row = per_day.get(day, {})
+            series.append({
+                'day': day,
+                'units': row.get('units', 0),
+                'revenue': row.get('revenue', 0),
+            })
+            day += timedelta(days=1)
+
+        top = list(
+            ProductSalesDaily.objects.filter(**in_period).values(
+                'product_id').annotate(
+                    units=Sum('units'),
+                    revenue=Sum('revenue')).order_by(
+                        f'-{order_by}',
+                        'product_id')[:params.validated_data['top']])
+        names = Product.objects.only('name').in_bulk(
+            [row['product_id'] for row in top])
+        for row in top:
+            # Deleted products keep their sales, but have no name.
+            product = names.get(row['product_id'])
+            row['name'] = product.name if product else None
+
+        return Response({
+            'start': start,
+            'end': end,
+            'status': statuses,
+            'totals': {
+                'units': sum(point['units'] for point in series),
+                'revenue': sum(point['revenue'] for point in series),
+            },
+            'series': series,
+            'top_products': top,
+        })
+
+
+class JobStatsAPIView(APIView):
+    """
+    Handles GET '/jobs/stats/' (staff only): queue depth and how long
+    recent jobs waited and ran, see 'api.jobs.queue_stats()'.
+    '?window=<seconds>' changes how far back "recent" goes (default 300).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            window = int(request.query_params.get('window', 300))
+        except ValueError:
+            raise serializers.ValidationError(
+                {'window': 'Must be a number of seconds.'})
+        return Response(queue_stats(max(1, window)))
+
+
+class UserListView(ConcurrencyLimitMixin, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = None
+    # Every user in one response: rate limited and counted against the
+    # 'expensive' concurrency budget, like '/product/info/'.
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'users'
+    throttle_cost = 5
+    concurrency_scope = 'expensive'
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if 'order_summary' in UserSerializer.included_fields(self.request):
+            # One JOIN instead of one query per user.
+            qs = qs.select_related('order_summary')
+        return qs
+
+
+# --- SERVER-SENT EVENTS ---
+# Instead of polling 'GET /orders/' to see if an order was confirmed,
+# clients can keep ONE connection open to '/orders/events/' and we push
+# every status change to them as it happens.
+#
+# This is a plain (async) Django view, not a DRF view: DRF views are
+# sync, and a sync view would hold a whole worker thread per open
+# stream. Run the project under ASGI (uvicorn/daphne + 'asgi.py') so
+# thousands of streams can share one worker.
+
+
+def authenticate(request):
+    """
+    Runs DRF's normal authentication classes (JWT, and sessions in 'dev')
+    on a plain Django request. Returns the user or None.
+    """
+    drf_request = Request(
+        request,
+        authenticators=[
+            auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ])
+    try:
+        user = drf_request.user
+    except AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
+
+
+async def order_event_stream(user, subscription, heartbeat=15):
+    """
+    Yields the SSE text for every event this user may see: their own
+    orders, or every order for staff.
+    """
+    # Tell the browser to reconnect after 3s if the connection drops.
+    yield 'retry: 3000\n\n'
+    try:
+        while True:
+            try:
+                event = await subscription.get(timeout=heartbeat)
+            except SubscriptionLost:
+                # We dropped events for this client. End the stream; the
+                # browser reconnects with 'Last-Event-ID' and catches up.
+                return
+            if event is None:
+                # A comment line keeps proxies from closing an idle stream.
+                yield ': keep-alive\n\n'
+                continue
+            event_id, data = event
+            if user.is_staff or data['user_id'] == user.pk:
+                yield (f'id: {event_id}\nevent: order-status\n'
+                       f'data: {json.dumps(data)}\n\n')
+    finally:
+        await subscription.close()
+
+
+async def order_events(request):
+    """
+    Handles GET '/orders/events/' (text/event-stream).
+
+    Each message looks like:
+        id: 42
+        event: order-status
+        data: {"order_id": "...", "user_id": 1, "previous_status": "Pending",
+               "status": "Confirmed", "changed_at": "..."}
+
+    Browsers send the last 'id' they saw as 'Last-Event-ID' when they
+    reconnect, and we replay what they missed (as long as the broker
+    still remembers it).
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED)
+
+    subscription = get_broker().subscribe(
+        request.headers.get('Last-Event-ID'))
+    response = StreamingHttpResponse(order_event_stream(user, subscription),
+                                     content_type='text/event-stream')
+    # 'no-transform': proxies (and our CompressionMiddleware) must not
+    # compress it either.
+    response['Cache-Control'] = 'no-cache, no-transform'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
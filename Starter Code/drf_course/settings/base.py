@@ -0,0 +1,247 @@
+"""
+Settings shared by every profile.
+
+This module only holds what the JSON API needs to run. The 'dev' and
+'prod' modules import everything from here and then add (dev) or
+tighten (prod) what they need:
+
+    drf_course.settings.dev   -> used by 'manage.py' (runserver, tests, ...)
+    drf_course.settings.prod  -> used by 'wsgi.py' / 'asgi.py' (gunicorn, uvicorn)
+
+Pick a profile explicitly with the 'DJANGO_SETTINGS_MODULE' env variable.
+"""
+from pathlib import Path
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+# (one more '.parent' than usual because we live in 'drf_course/settings/')
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/4.0/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = 'django-insecure-%hjisw!0c0)bs&s9m#0e(#(=g54-#f+q2-d3+p%puk)0=5qrp#'
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = False
+
+ALLOWED_HOSTS = []
+
+# Application definition
+
+# Only the apps the API can't live without. Everything that is just
+# nice to have while developing (admin, silk, django_extensions, the
+# schema generator...) is added in 'dev.py'.
+INSTALLED_APPS = [
+    'django.contrib.auth', 'django.contrib.contenttypes', 'api',
+    'rest_framework', 'django_filters'
+]
+
+# Every middleware here runs on *every* request, so keep it short.
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'drf_course.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'drf_course.wsgi.application'
+
+# Database
+# https://docs.djangoproject.com/en/4.0/ref/settings/#databases
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+}
+
+# Password validation
+# https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME':
+        'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME':
+        'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME':
+        'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME':
+        'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+# Internationalization
+# https://docs.djangoproject.com/en/4.0/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/4.0/howto/static-files/
+
+STATIC_URL = 'static/'
+
+# Uploaded files (product images and their renditions).
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Product image renditions (api/images.py): WebP copies at these widths
+# are made by a background job ('manage.py run_jobs') after every image
+# upload. Their file names contain a content hash, so serve 'media/
+# product/renditions/' with 'Cache-Control: public, max-age=31536000,
+# immutable'.
+PRODUCT_IMAGE_WIDTHS = [200, 600, 1200]
+
+# Response compression (api.middleware.CompressionMiddleware).
+# brotli / zstd are used when the 'brotli' / 'zstandard' packages are
+# installed, otherwise we fall back to gzip.
+COMPRESSION_MIN_SIZE = 512  # bytes
+COMPRESSION_ENCODINGS = ['br', 'zstd', 'gzip']  # preference order
+
+# Max number of ids in one batch request, e.g. '/product/?ids=1,2,3'
+# (api.batch.BatchRetrieveMixin).
+API_BATCH_MAX_IDS = 100
+
+# 'POST /orders/bulk/': max orders per request, and how many orders are
+# written per database transaction.
+API_BULK_ORDERS_MAX = 5000
+API_BULK_ORDERS_CHUNK_SIZE = 500
+
+# 'Idempotency-Key' support on order writes (api/idempotency.py).
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # seconds a stored response is replayed
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # seconds before an unfinished request is
+                               # considered dead and its key can be reused
+
+# Where order status changes are published for '/orders/events/'
+# (api/events.py). The in-process broker only reaches streams in the same
+# worker process; with several ASGI workers use the Redis broker:
+#   {'BACKEND': 'api.events.RedisBroker',
+#    'OPTIONS': {'url': 'redis://localhost:6379/0'}}
+ORDER_EVENTS_BROKER = {
+    'BACKEND': 'api.events.InProcessBroker',
+    'OPTIONS': {
+        'history': 1000,  # events kept for 'Last-Event-ID' resumes
+    },
+}
+
+# Change feed '/changes/?since=<token>' (api/changes.py).
+CHANGES_PAGE_SIZE = 500  # events per response by default ...
+CHANGES_MAX_PAGE_SIZE = 5000  # ... and at most, with '&limit='
+
+# Confirmed/cancelled orders older than this many days are moved to the
+# archive tables by 'manage.py archive_orders' (api/archive.py).
+ARCHIVE_ORDERS_AFTER_DAYS = 180
+
+# Per-process memory cache. With several server processes, use a shared
+# cache (e.g. 'django.core.cache.backends.redis.RedisCache') so that
+# invalidations reach all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# '/product/?facets=1' (api/facets.py): price bucket edges, and how long
+# the counts of one filter combination are cached.
+PRODUCT_PRICE_FACETS = [10, 50, 100, 500]
+PRODUCT_FACETS_CACHE_TIMEOUT = 60  # seconds
+
+# Rate limits of the expensive endpoints (api/throttling.py). Per scope
+# and kind of user: (bucket size, tokens added per second). A request
+# takes its view's 'throttle_cost' tokens.
+API_TOKEN_BUCKETS = {
+    'catalog': {  # '/product/info/', 10 tokens a call
+        'anon': (30, 1),
+        'user': (100, 2),
+        'staff': (300, 10),
+    },
+    'users': {  # '/api/users/', 5 tokens a call
+        'anon': (10, 0.5),
+        'user': (25, 1),
+        'staff': (100, 5),
+    },
+}
+# 'local': buckets in each process's memory. 'cache': in the 'default'
+# cache, shared by all processes if that cache is (Redis, Memcached);
+# those are per time window (see 'CacheBuckets').
+API_THROTTLE_BACKEND = 'local'
+# Expensive requests allowed to run at the same time, per process. More
+# are answered with 503 + 'Retry-After' (seconds) instead of queueing.
+API_CONCURRENCY_LIMITS = {'expensive': 2}
+API_CONCURRENCY_RETRY_AFTER = 1
+
+# Staff sales analytics 'GET /analytics/sales/' (read from the daily
+# rollups, see api/rollups.py).
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_DAYS = 366
+
+# Background jobs stored in the database (api/jobs.py, 'manage.py
+# run_jobs').
+JOBS_WORKERS = 4  # jobs a worker command runs at the same time
+JOBS_POLL_INTERVAL = 1  # seconds between looks at an empty queue
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BASE_DELAY = 10  # seconds before the 1st retry, then doubling
+JOBS_RETRY_MAX_DELAY = 60 * 60  # ... but never more than this
+JOBS_TIMEOUT = 10 * 60  # a job "running" longer than this is taken back
+JOBS_KEEP_DONE = 24 * 60 * 60  # seconds finished jobs are kept (stats)
+
+# 'manage.py test' with a fast password hasher and the seeded datasets of
+# api/testing.py. Add '--parallel auto' to use every CPU.
+TEST_RUNNER = 'api.testing.TestRunner'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+AUTH_USER_MODEL = 'api.User'
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+    ],
+    # Plain JSON only. The browsable HTML API is switched on in 'dev.py'.
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+    'DEFAULT_FILTER_BACKENDS':
+    ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_PAGINATION_CLASS':
+    'rest_framework.pagination.PageNumberPagination',
+    'PAGE_SIZE':
+    5,
+    # How many proxies in front of the app add to 'X-Forwarded-For'.
+    # Throttles tell anonymous clients apart by IP address; clients can
+    # send any 'X-Forwarded-For' they like, so with 0 it's ignored and
+    # the address of the connection is used. Behind a load balancer, set
+    # this to the number of proxies (and make sure they add the header).
+    'NUM_PROXIES':
+    0,
+}
@@ -0,0 +1,24 @@
+"""
+Production profile: only what the JSON API needs.
+
+No admin, sessions, messages, silk, django_extensions or schema
+generator, so workers boot faster and every request only goes through
+the short middleware list from 'base.py'. Authentication is JWT only.
+
+This is the default for 'wsgi.py' and 'asgi.py'.
+"""
+import os
+
+from .base import *  # noqa: F401,F403
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+DEBUG = False
+
+# e.g. DJANGO_ALLOWED_HOSTS="api.example.com,www.example.com"
+ALLOWED_HOSTS = [
+    host.strip()
+    for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',')
+    if host.strip()
+]
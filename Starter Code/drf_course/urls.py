@@ -1,23 +1,45 @@
-from django.contrib import admin
+from django.apps import apps
+from django.conf import settings
+from django.conf.urls.static import static
 from django.urls import include, path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', include('api.urls')),
-    path('silk/', include('silk.urls', namespace='silk')),
     path('api/token/', TokenObtainPairView.as_view(),
          name='token_obtain_pair'),
     path('api/token/refresh/',
          TokenRefreshView.as_view(),
          name='token_refresh'),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    # Optional UI:
-    path('api/schema/swagger-ui/',
-         SpectacularSwaggerView.as_view(url_name='schema'),
-         name='swagger-ui'),
-    path('api/schema/redoc/',
-         SpectacularRedocView.as_view(url_name='schema'),
-         name='redoc'),
 ]
+
+# The apps below are only installed in the 'dev' settings profile.
+# We import them *inside* the 'if' so the production profile never
+# pays the import cost (and doesn't even need them installed).
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns += [path('admin/', admin.site.urls)]
+
+if apps.is_installed('silk'):
+    urlpatterns += [path('silk/', include('silk.urls', namespace='silk'))]
+
+if apps.is_installed('drf_spectacular'):
+    from drf_spectacular.views import (SpectacularAPIView,
+                                       SpectacularRedocView,
+                                       SpectacularSwaggerView)
+
+    urlpatterns += [
+        path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+        # Optional UI:
+        path('api/schema/swagger-ui/',
+             SpectacularSwaggerView.as_view(url_name='schema'),
+             name='swagger-ui'),
+        path('api/schema/redoc/',
+             SpectacularRedocView.as_view(url_name='schema'),
+             name='redoc'),
+    ]
+
+# Serves uploaded files while developing ('static()' does nothing when
+# DEBUG is off; in production the web server serves MEDIA_ROOT).
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)